@@ -1,20 +1,32 @@
+import time
+
+STARTUP_TIME = time.perf_counter()
+
 from enum import Enum, auto
 
 import random
 import os
 from uuid import uuid1
-from settings.Settings import screen_size, max_fps
-from stockfish import Stockfish
+import settings.Settings as settings
 
 import pygame
 import chess
+import chess.pgn
 import sys
-import glob
-import chess.engine
-import asyncio
 import threading
+import queue
 
+from util.Build import find_engine
 from util.Button import ButtonGroup
+from util.Engine import EnginePool, EngineProcess, engine_options
+from util.Heatmap import Heatmap
+from util.Layout import Layout
+from util.Metrics import MetricsExporter, metrics, games_started, games_finished, games_active, game_moves, game_plies
+from util.Overlay import PerformanceOverlay
+from util.Profiler import profiler
+from util.Recorder import Recorder
+from util.Simul import MiniBoard
+from util.Sound import SoundKey, SoundManager
 
 class GameColor(Enum):
     WHITE = auto()
@@ -29,37 +41,81 @@ class ChessPiece(Enum):
     QUEEN = "Q"
 
 class GamePiece:
+    sprites: dict[tuple, pygame.Surface] = {}
+    images: dict[tuple, pygame.Surface] = {}
+    # Set by Client.set_layout before the first piece is created, reading the window size here would parse the settings at import
+    layout: Layout = None
 
     def __init__(self, color: GameColor, piece: ChessPiece, location: tuple):
         self.color = color
         self.piece = piece
         self.location = location
-        self.new_location = None
-
-        self.image = self.load_image()
 
-        square_size = min(screen_size[0] // 10, screen_size[1] // 10)
-
-        self.image = pygame.transform.smoothscale(self.image, (square_size, square_size))
+        self.image: pygame.Surface = None
+        self.load_sprite_image()
 
     def update(self, piece: ChessPiece = ChessPiece.QUEEN):
         self.piece = piece
-        self.image = self.load_image()
 
-        square_size = min(screen_size[0] // 10, screen_size[1] // 10)
+        self.image = None
+        self.load_sprite_image()
+
+    def load_sprite_image(self):
+        # Without a layout (no Client yet, e.g. util.Perft) the sprite is loaded on first draw instead
+        if GamePiece.layout is not None:
+            self.image = GamePiece.get_sprite(self.color, self.piece, GamePiece.layout.square_size)
 
-        self.image = pygame.transform.smoothscale(self.image, (square_size, square_size))
+    def get_image(self) -> pygame.Surface:
+        if self.image is None:
+            self.load_sprite_image()
+        return self.image
 
     def load_image(self):
-        color_folder = self.color.name.lower()
-        piece_name = self.piece.name.lower()
+        return GamePiece.load_sprite(self.color, self.piece)
+
+    @staticmethod
+    def load_sprite(color: GameColor, piece: ChessPiece) -> pygame.Surface:
+        color_folder = color.name.lower()
+        piece_name = piece.name.lower()
         
         image_path = f"images/static/{color_folder}/{piece_name}.png"
 
         if os.path.exists(image_path):
             return pygame.image.load(image_path)
         else:
-            raise FileNotFoundError(f"Image for {self.color.name} {self.piece.name} not found.")
+            raise FileNotFoundError(f"Image for {color.name} {piece.name} not found.")
+
+    @staticmethod
+    def get_sprite(color: GameColor, piece: ChessPiece, size: int) -> pygame.Surface:
+        key = (color, piece, size)
+        sprite = GamePiece.sprites.get(key)
+
+        if sprite is None:
+            image = GamePiece.images.get((color, piece))
+            if image is None:
+                image = GamePiece.images[(color, piece)] = GamePiece.load_sprite(color, piece)
+
+            sprite = pygame.transform.smoothscale(image, (size, size))
+
+            # Blits are only fast when the sprite matches the display format, which needs an open window
+            if pygame.display.get_surface() is not None:
+                sprite = sprite.convert_alpha()
+
+            GamePiece.sprites[key] = sprite
+
+        return sprite
+
+    @staticmethod
+    def set_layout(layout: Layout):
+        # Sprites for the old square size are never drawn again
+        GamePiece.layout = layout
+        GamePiece.sprites.clear()
+
+    @staticmethod
+    def prewarm(size: int):
+        for color in GameColor:
+            for piece in ChessPiece:
+                GamePiece.get_sprite(color, piece, size)
 
     def get_possible_moves(self, game, client, board: dict) -> list:
         possible_moves = []
@@ -70,6 +126,7 @@ class GamePiece:
         return possible_moves
 
     def can_move(self, game, client, new_pos: tuple, board: list) -> bool:
+        profiler.count("can_move")
         new_row, new_col = new_pos
 
         if game.next_move is not self.color:
@@ -262,7 +319,6 @@ class GameClient:
         self.name: str = name
         self.rating: int = rating
         self.pieces: list[GamePiece] = []
-        self.promoting: list[GamePiece] = []
         self.king_moved: bool = False
         self.left_rook_moved: bool = False
         self.right_rook_moved: bool = False
@@ -299,24 +355,22 @@ class GameClient:
             
         return None
     
-    def play_sound(self, key: str):
+    def play_sound(self, key: SoundKey):
         if self.client:
-            sound = self.client.get_sound(key)
-            if sound:
-                sound.play()
+            self.client.sounds.play(key)
 
 class AIGameClient(GameClient):
-    def __init__(self):
+    stockfish_path = "engine\\stockfish-windows-x86-64.exe"
+
+    def __init__(self, engine: EngineProcess = None):
         self.difficulty = 20
-        self.stockfish_path = "engine\stockfish-windows-x86-64.exe"
+        self.engine = engine if engine is not None else EngineProcess(self.stockfish_path)
 
         super().__init__("Engine", -1)
 
-    def get_stockfish_move(self, board: chess.Board):
-        with chess.engine.SimpleEngine.popen_uci(self.stockfish_path) as engine:
-
-            result = engine.play(board, chess.engine.Limit(time=2.0))
-            return result.move
+    def get_stockfish_move(self, board: chess.Board, game: object = None):
+        # A new game reuses the running engine, python-chess sends ucinewgame when `game` changes
+        return self.engine.play(board, 2.0, game)
 
 class Game:
     def __init__(self, one: GameClient, two: GameClient):
@@ -330,6 +384,12 @@ class Game:
         self.clock = pygame.time.Clock()
         self.prev = None
         self.last = None
+        self.finished = False
+        self.replies = queue.Queue()
+        self.premoves: list[tuple[GamePiece, tuple, tuple]] = []
+
+        games_started.inc()
+        games_active.inc()
 
         self.one.color = GameColor.WHITE
         self.two.color = GameColor.BLACK
@@ -339,20 +399,20 @@ class Game:
         else:
             self.ai_client = None  # No AI, two human players
 
-        square_size = min(screen_size[0] // 10, screen_size[1] // 10)
-        actual_board_width = square_size * 8
-        padding = (screen_size[0] - actual_board_width) // 4
-        controls_width = screen_size[0] // 10 * 4 - (padding)
-        controls_height = screen_size[1] // 10 * 8
-        controls_rect = pygame.Rect(padding + actual_board_width, (screen_size[1] - controls_height) // 2, controls_width, controls_height)
-
-        self.side_buttons = ButtonGroup(controls_rect, background_color="#222222")
+        self.side_buttons = ButtonGroup(GamePiece.layout.controls_rect.copy(), background_color="#222222")
 
         self.side_buttons.add_button('previous', '<', "Previous Move")
         self.side_buttons.add_button('next', '>', "Next Move")
 
         self.setup()
 
+    def update_layout(self):
+        self.side_buttons.controls_rect = GamePiece.layout.controls_rect.copy()
+        self.side_buttons.update_buttons()
+
+        for piece in self.one.pieces + self.two.pieces:
+            piece.load_sprite_image()
+
     def get_moves(self, color: GameColor) -> list:
         filtered_moves = []
         
@@ -413,13 +473,17 @@ class Game:
             self.run_ai_move_async(client, piece, old, new)
     
     def run_async(self, func, *args):
+        import asyncio
+
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
         loop.run_until_complete(func(*args))
 
-    def move_piece(self, client: GameClient, old: tuple, new: tuple) -> bool:
+    def move_piece(self, client: GameClient, old: tuple, new: tuple, promotion: ChessPiece = None) -> bool:
         piece = self.get_piece_at(old)
         if piece:
+            castling = piece.piece == ChessPiece.KING and abs(new[1] - old[1]) == 2
+
             if piece.piece == ChessPiece.KING:
                 self.get_client(piece.color).king_moved = True
 
@@ -430,41 +494,91 @@ class Game:
                 if old[0] == 7:
                     self.get_client(piece.color).right_rook_moved = True
 
-            if (new[0] == 0 or new[0] == 7) and piece.piece == ChessPiece.PAWN:
-                piece.new_location = new
-                client.client.promoting.append(piece)
-                return False
+            # There is no piece picker, a pawn reaching the last rank without a choice becomes a queen like a premove does
+            if (new[0] == 0 or new[0] == 7) and piece.piece == ChessPiece.PAWN and promotion is None:
+                promotion = ChessPiece.QUEEN
+
+            from_square = chess.square(old[1], old[0])
+            to_square = chess.square(new[1], new[0])
+
+            move = chess.Move(from_square, to_square, promotion=chess.Piece.from_symbol(promotion.value).piece_type if promotion else None)
+            legal = move in self.board.legal_moves
 
-            captured_piece = self.get_piece_at(new)
+            # En passant takes the pawn beside the moving one, not a piece on the destination square
+            en_passant = legal and self.board.is_en_passant(move)
+            captured_piece = self.get_piece_at((old[0], new[1]) if en_passant else new)
             if captured_piece is not None and captured_piece.color != piece.color:
                 self.capture_piece(captured_piece)
+            else:
+                captured_piece = None
 
             piece.location = new
 
-            self.moves.append(self.get_notation(piece.piece, old, new, captured_piece is not None))
-
-            from_square = chess.square(old[1], old[0])
-            to_square = chess.square(new[1], new[0])
-
-            move = chess.Move(from_square, to_square)
+            if castling:
+                rook_col, rook_new_col = (7, 5) if new[1] > old[1] else (0, 3)
+                rook = self.get_piece_at((old[0], rook_col))
+                if rook is not None:
+                    rook.location = (old[0], rook_new_col)
 
-            if move in self.board.legal_moves:
+            if legal:
+                self.moves.append(self.board.san(move))
                 self.board.push(move)
+            elif castling:
+                self.moves.append("O-O" if new[1] > old[1] else "O-O-O")
+            else:
+                self.moves.append(self.get_notation(piece.piece, old, new, captured_piece is not None) + (f"={promotion.value}" if promotion else ""))
+
+            if promotion is not None:
+                piece.update(promotion)
 
             self.prev = old
             self.last = new
 
+            game_moves.inc(side=piece.color.name.lower())
+
+            if self.board.is_game_over() and not self.finished:
+                self.finish()
+
             self.next_move = GameColor.BLACK if self.next_move == GameColor.WHITE else GameColor.WHITE
 
             if self.board.is_check():
-                client.play_sound("move-check.mp3")
+                client.play_sound(SoundKey.CHECK)
+            elif castling:
+                client.play_sound(SoundKey.CASTLE)
+            elif promotion is not None:
+                client.play_sound(SoundKey.PROMOTE)
             elif captured_piece:
-                client.play_sound("move-capture.mp3")
+                client.play_sound(SoundKey.CAPTURE)
             else:
-                client.play_sound("move-self.mp3")
+                client.play_sound(SoundKey.MOVE)
 
             return True
 
+    def finish(self):
+        self.finished = True
+
+        games_finished.inc(result=self.board.result())
+        games_active.dec()
+        game_plies.observe(len(self.board.move_stack))
+
+        if settings.journal_path:
+            self.save(settings.journal_path)
+
+    def save(self, path: str):
+        # Appends the game to the journal, util/Export.py reads it back as training data
+        game = chess.pgn.Game.from_board(self.board)
+        game.headers["Event"] = "chess-client"
+        game.headers["Date"] = time.strftime("%Y.%m.%d")
+        game.headers["White"] = self.one.name
+        game.headers["Black"] = self.two.name
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        with open(path, "a") as f:
+            print(game, file=f, end="\n\n")
+
     def run_ai_move_async(self, client: GameClient, piece: GamePiece, old: tuple, new: tuple):
         ai_thread = threading.Thread(target=self.handle_ai_move, args=(client, piece, old, new))
         ai_thread.daemon = True
@@ -474,16 +588,61 @@ class Game:
         if self.next_move != self.get_client(piece.color):
             if self.ai_client and self.next_move == self.ai_client.color:
                 if self.board.turn == chess.BLACK:
-                    ai_move = self.ai_client.get_stockfish_move(self.board)
-                    self.board.push(ai_move)
+                    # Only the search runs on this thread, drain_replies applies the move on the main thread
+                    self.replies.put((client, self.ai_client.get_stockfish_move(self.board.copy(), self)))
+
+    def drain_replies(self) -> list[chess.Move]:
+        applied = []
+
+        while not self.replies.empty():
+            client, ai_move = self.replies.get_nowait()
+
+            from_square = ai_move.from_square
+            to_square = ai_move.to_square
+
+            from_row, from_col = chess.square_rank(from_square), chess.square_file(from_square)
+            to_row, to_col = chess.square_rank(to_square), chess.square_file(to_square)
+
+            promotion = ChessPiece(chess.piece_symbol(ai_move.promotion).upper()) if ai_move.promotion else None
+
+            self.move_piece(client, (from_row, from_col), (to_row, to_col), promotion)
+            applied.append(ai_move)
+
+            # Same frame as the reply, so a queued premove costs no extra frame
+            self.play_premove(client)
 
-                    from_square = ai_move.from_square
-                    to_square = ai_move.to_square
+        return applied
 
-                    from_row, from_col = chess.square_rank(from_square), chess.square_file(from_square)
-                    to_row, to_col = chess.square_rank(to_square), chess.square_file(to_square)
+    def play_premove(self, client: GameClient):
+        if not self.premoves or self.finished:
+            return
+
+        piece, old, new = self.premoves.pop(0)
+
+        promotion = ChessPiece.QUEEN if piece.piece == ChessPiece.PAWN and new[0] in (0, 7) else None
+        move = chess.Move(chess.square(old[1], old[0]), chess.square(new[1], new[0]), chess.QUEEN if promotion else None)
+
+        # The reply made the premove illegal, the moves chained after it can't be trusted either
+        if piece.location != old or move not in self.board.legal_moves:
+            self.premoves.clear()
+            return
 
-                    self.move_piece(client, (from_row, from_col), (to_row, to_col))
+        if self.move_piece(client, old, new, promotion):
+            self.run_ai_move_async(client, piece, old, new)
+
+    def get_premove_location(self, piece: GamePiece) -> tuple:
+        location = piece.location
+        for premove_piece, old, new in self.premoves:
+            if premove_piece is piece:
+                location = new
+        return location
+
+    def get_premove_piece_at(self, pos: tuple, color: GameColor) -> GamePiece | None:
+        # Where the own pieces will stand once every queued premove has been played
+        for piece in self.get_client(color).pieces:
+            if self.get_premove_location(piece) == pos:
+                return piece
+        return None
 
     def capture_piece(self, piece: GamePiece):
         self.get_client(piece.color).pieces.remove(piece)
@@ -538,29 +697,60 @@ class GameState(Enum):
     QUIT = auto()
 
 class Client:
-    def __init__(self) -> None:
-        self.audios = {}
+    def __init__(self, measure_startup: bool = False, engine: EngineProcess = None, record_path: str = None) -> None:
+        self.sounds = SoundManager(channels=settings.audio_channels)
+        if engine is None:
+            # One memory budget for every engine this client runs, split into equal Hash sizes
+            engines = settings.simul_engines if settings.simul_boards > 1 else 1
+            options = engine_options(settings.engine_memory, engines, settings.engine_threads)
+            engine = EnginePool(AIGameClient.stockfish_path, engines, options) if settings.simul_boards > 1 else EngineProcess(AIGameClient.stockfish_path, options)
+
+        self.engine = engine
+        self.measure_startup = measure_startup
+        self.recorder = Recorder(record_path) if record_path else None
+        self.startup_marks: dict[str, float] = {}
+        self.exporter = MetricsExporter(metrics)
 
         self.load()
         self.name: str = None
         self.client: GameClient = None
         self.game: Game = None
+        self.games: list[Game] = []
+        self.mini_boards: list[MiniBoard] = []
         self.arrows: dict[tuple, tuple] = {}
         self.selected_squares: list[tuple] = []
         self.selected: tuple = None
-        self.promoting: list[GamePiece] = []
+        self.premove_selected: GamePiece = None
         self.dragged_piece: GamePiece = None
         self.dragged_piece_pos: tuple = None
         self.state: GameState = GameState.WAITING
         self.current_cursor: int = pygame.SYSTEM_CURSOR_ARROW
 
-        flags = pygame.DOUBLEBUF
+        flags = pygame.DOUBLEBUF | pygame.RESIZABLE
 
-        self.screen: pygame.Surface = pygame.display.set_mode(screen_size, flags, 16)
+        # No forced depth, SDL picks the desktop format so blits to the window need no conversion
+        self.window: pygame.Surface = pygame.display.set_mode(settings.screen_size, flags)
+        self.screen: pygame.Surface = None
+        self.render_scale: float = settings.render_scale
         self.primary_font: pygame.font.Font = pygame.font.Font(None, 24)
         self.secondary_font: pygame.font.Font = pygame.font.Font(None, 16)
 
+        self.overlay = PerformanceOverlay(profiler, ["events", "draw_board", "draw_controls", "display.update"], ["can_move"], ["engine"])
+        self.overlay.visible = settings.profiling_overlay
+        self.heatmap = Heatmap(settings.analysis_heatmap)
+        profiler.dump_every = settings.profiling_dump_every
+
+        self.set_layout()
+
+        # Show the waiting screen before anything heavy happens, the rest is prewarmed in the background
+        self.draw_waiting()
+        self.present()
+        self.mark("first frame")
+
+        self.prewarm()
+
     def load(self):
+        SoundManager.pre_init(settings.audio_buffer)
         pygame.init()
         pygame.mixer.init()
 
@@ -570,21 +760,79 @@ class Client:
 
         pygame.display.set_icon(logo)
 
-        for sound_path in glob.glob("assets/audio/*.mp3"):
-            try:
-                sound = pygame.mixer.Sound(sound_path)
-                self.audios[sound_path] = sound
-            except pygame.error as e:
-                print(f"Failed to load sound {sound_path}: {e}")
-
-    def get_sound(self, key: str) -> pygame.mixer.Sound | None:
-        for sound_path, sound in self.audios.items():
-            sound_name = os.path.basename(sound_path)
-            if sound_name == key:
-                return sound
-        return None
+        self.sounds.start()
+
+    def prewarm(self):
+        # Prefer the fastest verified local build (python -m util.Build) over the bundled Windows binary
+        self.engine.path = find_engine(self.engine.path)
+        self.engine.start()
+        self.exporter.start(settings.metrics_mode, settings.metrics_port, settings.metrics_path, settings.metrics_interval, settings.metrics_host)
+
+        sprite_thread = threading.Thread(target=self.prewarm_sprites, daemon=True)
+        sprite_thread.start()
+
+    def prewarm_sprites(self):
+        GamePiece.prewarm(self.layout.square_size)
+        self.mark("sprites")
+
+    def set_layout(self):
+        # SDL has already resized the display surface when VIDEORESIZE arrives
+        self.window = pygame.display.get_surface()
+        self.layout = Layout(self.window.get_size(), self.render_scale)
+
+        # Drawing happens on a smaller canvas that present() scales up to the window
+        if self.layout.scaled:
+            self.screen = pygame.Surface(self.layout.size).convert()
+        else:
+            self.screen = self.window
+
+        GamePiece.set_layout(self.layout)
+        self.heatmap.surface = None
+
+        # Every simul board, not only the active one, so switching after a resize draws at the new size
+        for game in self.games:
+            game.update_layout()
+        if self.game is not None and self.game not in self.games:
+            self.game.update_layout()
+
+    def present(self):
+        if self.layout.scaled:
+            pygame.transform.smoothscale(self.screen, self.layout.window_size, self.window)
+
+        pygame.display.update()
+
+    def mouse_pos(self) -> tuple[int, int]:
+        return self.layout.to_canvas(pygame.mouse.get_pos())
+
+    def mark(self, name: str, at: float = None):
+        self.startup_marks[name] = (at if at is not None else time.perf_counter()) - STARTUP_TIME
+
+    def report_startup(self) -> bool:
+        if not (self.engine.ready.is_set() and self.sounds.loaded.is_set() and "sprites" in self.startup_marks):
+            return False
+
+        self.mark("sounds", self.sounds.loaded_at)
+
+        if self.engine.engine is not None:
+            self.mark("first engine reply", self.engine.ready_at)
+
+        for name in ["first frame", "sprites", "sounds", "first engine reply"]:
+            if name in self.startup_marks:
+                print(f"time to {name}: {self.startup_marks[name] * 1000:.1f} ms")
+            else:
+                print(f"time to {name}: unavailable ({self.engine.error})")
+
+        return True
+
+    def get_sound(self, key: SoundKey) -> pygame.mixer.Sound | None:
+        return self.sounds.get(key)
 
     def quit(self):
+        if self.recorder is not None:
+            self.recorder.stop(self.game.moves if self.game is not None else [])
+
+        self.exporter.stop()
+        self.engine.quit()
         pygame.quit()
 
     def active(self) -> bool:
@@ -603,83 +851,173 @@ class Client:
                 if event.type == pygame.QUIT:
                     self.state = GameState.QUIT
 
+                if event.type == pygame.VIDEORESIZE:
+                    self.set_layout()
+
+            if self.measure_startup and self.report_startup():
+                self.state = GameState.QUIT
+
             pressed = pygame.key.get_pressed()
 
             if pressed[pygame.K_SPACE]:
-                self.game = Game(GameClient("User"), AIGameClient())
-
-                self.client = self.game.one
-                self.game.one.set_client(self)
-                self.state = GameState.STARTED
+                if settings.simul_boards > 1:
+                    self.start_simul(settings.simul_boards)
+                else:
+                    self.start_game(Game(GameClient("User"), AIGameClient(self.engine)))
 
-            pygame.display.update()
+            self.present()
 
         while self.state == GameState.STARTED:
 
-            self.game.clock.tick(max_fps)
+            self.game.clock.tick(settings.max_fps)
+            self.frame(pygame.event.get())
 
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    self.state = GameState.QUIT
+    def start_game(self, game: Game):
+        self.game = game
+        self.client = self.game.one
+        self.game.one.set_client(self)
+        self.state = GameState.STARTED
 
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    if event.button == 3:  # Right-click logic
-                        self.dragged_piece = None
-                        self.dragged_piece_pos = None
-
-                    if event.button == 1:  # Left-click logic
-                        self.selected_squares.clear()
-                        mouse_x, mouse_y = event.pos
-                        if self.game is not None:
-                            for square in self.game.squares.keys():
-                                if self.game.squares.get(square).collidepoint((mouse_x, mouse_y)):
-                                    piece = self.game.get_piece_at(square)
-
-                                    # Handle first-time selection
-                                    if self.selected is None:
-                                        if piece is not None:
-                                            self.selected = square
-                                            self.dragged_piece = piece
-                                            self.dragged_piece_pos = event.pos
-                                    else:
-                                        # Prepare for deselection or move logic
-                                        if square == self.selected:
-                                            self.dragged_piece = piece
-                                            self.dragged_piece_pos = event.pos
-                                        else:
-                                            selected_piece = self.game.get_piece_at(self.selected)
-                                            if selected_piece and selected_piece.can_move(self.game, self.client, square, self.game.one.pieces + self.game.two.pieces):
-                                                # Handle valid move
-                                                self.game.handle_move(
-                                                    self.game.get_client(selected_piece.color),
-                                                    selected_piece,
-                                                    self.selected,
-                                                    square
-                                                )
-                                                self.selected = None
-                                                self.dragged_piece = None
-                                                self.dragged_piece_pos = None
-                                            else:
-                                                # Change selection to a new square
-                                                self.selected = None if self.game.get_piece_at(square) is None else self.game.get_piece_at(square).location
-                                                self.dragged_piece = None if self.game.get_piece_at(square) is None else self.game.get_piece_at(square)
-                                                self.dragged_piece_pos = None if self.game.get_piece_at(square) is None else (mouse_x, mouse_y)
-
-                if event.type == pygame.MOUSEMOTION:
-                    if self.dragged_piece is not None:
-                        self.dragged_piece_pos = event.pos
-
-                if event.type == pygame.MOUSEBUTTONUP:
-                    if event.button == 1 and self.dragged_piece is not None:
-                        mouse_x, mouse_y = event.pos
-                        for square in self.game.squares.keys():
-                            if self.game.squares.get(square).collidepoint((mouse_x, mouse_y)):
-                                # Deselect only on subsequent clicks (not the first time)
-                                if self.selected == square:
-                                    self.selected = None
-                                    self.dragged_piece = None
-                                    self.dragged_piece_pos = None
-                                elif self.selected is not None:
+        if self.recorder is not None:
+            self.recorder.start({
+                "window": list(self.layout.window_size),
+                "render_scale": self.layout.render_scale,
+                "overlay": self.overlay.visible,
+                "heatmap": self.heatmap.visible,
+            })
+
+    def start_simul(self, count: int):
+        # Every board gets its own Game, all of them search through the one engine pool
+        self.games = [Game(GameClient("User"), AIGameClient(self.engine)) for _ in range(count)]
+        self.mini_boards = [MiniBoard(GamePiece.get_sprite) for _ in range(count)]
+
+        for game in self.games:
+            game.one.set_client(self)
+
+        self.start_game(self.games[0])
+
+    def switch_game(self, index: int):
+        if self.games[index] is self.game:
+            return
+
+        self.game = self.games[index]
+        self.client = self.game.one
+        self.selected = None
+        self.selected_squares.clear()
+        self.premove_selected = None
+        self.dragged_piece = None
+        self.dragged_piece_pos = None
+
+    def next_waiting_game(self) -> int | None:
+        # The next board after the active one where the engine has replied
+        start = self.games.index(self.game)
+        for offset in range(1, len(self.games) + 1):
+            index = (start + offset) % len(self.games)
+            if self.is_waiting(self.games[index]):
+                return index
+        return None
+
+    def is_waiting(self, game: Game) -> bool:
+        return not game.finished and game.next_move is game.one.color
+
+    def frame(self, events: list[pygame.event.Event]):
+        profiler.begin_frame()
+
+        with profiler.phase("events"):
+            # Captured before handle_event maps the positions to canvas coordinates
+            captured = self.recorder.capture(events) if self.recorder is not None else None
+
+            for event in events:
+                self.handle_event(event)
+
+            # Engine replies and the premoves queued behind them land before this frame is drawn
+            replies = self.game.drain_replies()
+            if replies and self.premove_selected is not None:
+                self.premove_selected = None
+                self.selected = None
+
+            for game in self.games:
+                if game is not self.game:
+                    game.drain_replies()
+
+            if captured is not None:
+                self.recorder.record(captured, [move.uci() for move in replies])
+
+        with profiler.phase("draw_board"):
+            self.draw_board()
+
+        with profiler.phase("draw_controls"):
+            self.draw_controls()
+
+        if self.overlay.visible:
+            self.overlay.draw(self.screen)
+
+        with profiler.phase("display.update"):
+            self.present()
+
+        profiler.end_frame()
+
+    def handle_event(self, event: pygame.event.Event):
+        if event.type == pygame.QUIT:
+            self.state = GameState.QUIT
+
+        if event.type == pygame.VIDEORESIZE:
+            self.set_layout()
+
+        if event.type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP, pygame.MOUSEMOTION):
+            # Window coordinates to canvas coordinates when rendering below the window resolution
+            event.pos = self.layout.to_canvas(event.pos)
+
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+            self.overlay.toggle()
+
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+            self.heatmap.toggle()
+
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_TAB and self.games:
+            index = self.next_waiting_game()
+            if index is not None:
+                self.switch_game(index)
+
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            if event.button == 3:  # Right-click logic
+                self.dragged_piece = None
+                self.dragged_piece_pos = None
+
+                if self.game is not None and self.game.premoves:
+                    self.game.premoves.clear()
+                    self.premove_selected = None
+                    self.selected = None
+
+            if event.button == 1:  # Left-click logic
+                for index, tile in enumerate(self.layout.tiles(len(self.games)) if self.games else []):
+                    if tile.collidepoint(event.pos):
+                        self.switch_game(index)
+
+                self.selected_squares.clear()
+                mouse_x, mouse_y = event.pos
+                if self.game is not None:
+                    for square in self.game.squares.keys():
+                        if self.game.squares.get(square).collidepoint((mouse_x, mouse_y)):
+                            if self.game.next_move is not self.client.color:
+                                # The engine is thinking, queue the move instead
+                                self.premove_click(square)
+                                continue
+
+                            piece = self.game.get_piece_at(square)
+
+                            # Handle first-time selection
+                            if self.selected is None:
+                                if piece is not None:
+                                    self.selected = square
+                                    self.dragged_piece = piece
+                                    self.dragged_piece_pos = event.pos
+                            else:
+                                # Prepare for deselection or move logic
+                                if square == self.selected:
+                                    self.dragged_piece = piece
+                                    self.dragged_piece_pos = event.pos
+                                else:
                                     selected_piece = self.game.get_piece_at(self.selected)
                                     if selected_piece and selected_piece.can_move(self.game, self.client, square, self.game.one.pieces + self.game.two.pieces):
                                         # Handle valid move
@@ -690,43 +1028,84 @@ class Client:
                                             square
                                         )
                                         self.selected = None
-                                    self.dragged_piece = None
-                                    self.dragged_piece_pos = None
-
-                    if event.button == 3:
-                        mouse_x, mouse_y = event.pos
-                        if self.game is not None:
-                            for square in self.game.squares.keys():
-                                if self.game.squares.get(square).collidepoint((mouse_x, mouse_y)):
-                                    if square in self.selected_squares:
-                                        self.selected_squares.remove(square)
+                                        self.dragged_piece = None
+                                        self.dragged_piece_pos = None
                                     else:
-                                        self.selected_squares.append(square)
-
-            self.draw_board()
-            self.draw_controls()
+                                        # Change selection to a new square
+                                        self.selected = None if self.game.get_piece_at(square) is None else self.game.get_piece_at(square).location
+                                        self.dragged_piece = None if self.game.get_piece_at(square) is None else self.game.get_piece_at(square)
+                                        self.dragged_piece_pos = None if self.game.get_piece_at(square) is None else (mouse_x, mouse_y)
+
+        if event.type == pygame.MOUSEMOTION:
+            if self.dragged_piece is not None:
+                self.dragged_piece_pos = event.pos
+
+        if event.type == pygame.MOUSEBUTTONUP:
+            if event.button == 1 and self.premove_selected is not None and self.game.next_move is not self.client.color:
+                # Dropping a premove piece on another square queues it like a second click
+                for square in self.game.squares.keys():
+                    if self.game.squares.get(square).collidepoint(event.pos) and square != self.selected:
+                        self.premove_click(square)
+
+            if event.button == 1 and self.dragged_piece is not None:
+                mouse_x, mouse_y = event.pos
+                for square in self.game.squares.keys():
+                    if self.game.squares.get(square).collidepoint((mouse_x, mouse_y)):
+                        # Deselect only on subsequent clicks (not the first time)
+                        if self.selected == square:
+                            self.selected = None
+                            self.dragged_piece = None
+                            self.dragged_piece_pos = None
+                        elif self.selected is not None:
+                            selected_piece = self.game.get_piece_at(self.selected)
+                            if selected_piece and selected_piece.can_move(self.game, self.client, square, self.game.one.pieces + self.game.two.pieces):
+                                # Handle valid move
+                                self.game.handle_move(
+                                    self.game.get_client(selected_piece.color),
+                                    selected_piece,
+                                    self.selected,
+                                    square
+                                )
+                                self.selected = None
+                            self.dragged_piece = None
+                            self.dragged_piece_pos = None
+
+            if event.button == 3:
+                mouse_x, mouse_y = event.pos
+                if self.game is not None:
+                    for square in self.game.squares.keys():
+                        if self.game.squares.get(square).collidepoint((mouse_x, mouse_y)):
+                            if square in self.selected_squares:
+                                self.selected_squares.remove(square)
+                            else:
+                                self.selected_squares.append(square)
+
+    def premove_click(self, square: tuple):
+        piece = self.game.get_premove_piece_at(square, self.client.color)
+
+        if self.premove_selected is None or piece is not None:
+            # Select (or switch to) one of our pieces where it will stand after the queued premoves
+            if square == self.selected:
+                piece = None
+            self.premove_selected = piece
+            self.selected = square if piece is not None else None
+            return
 
-            pygame.display.update()
+        self.game.premoves.append((self.premove_selected, self.selected, square))
+        self.premove_selected = None
+        self.selected = None
 
     def draw_waiting(self):
-        temp: pygame.Surface = pygame.Surface([screen_size[0], screen_size[1]])
-        temp.fill("#111111")
-
-        self.screen.blit(temp, [0,0])
+        self.screen.fill("#111111")
 
     def draw_board(self):
-        temp: pygame.Surface = pygame.Surface([screen_size[0], screen_size[1]])
-        temp.fill("#302e2b")
-
-        self.screen.blit(temp, [0,0])
-
-        square_size = min(screen_size[0] // 10, screen_size[1] // 10)
+        self.screen.fill("#302e2b")
 
-        actual_board_width = square_size * 8
-        actual_board_height = square_size * 8
-
-        board_x = (screen_size[0] - actual_board_width) // 8
-        board_y = (screen_size[1] - actual_board_height) // 2
+        layout = self.layout
+        square_size = layout.square_size
+        board_x = layout.board_x
+        board_y = layout.board_y
+        mouse_pos = self.mouse_pos()
 
         for row in range(8):
             for col in range(8):
@@ -749,6 +1128,9 @@ class Client:
                 if self.game.last == (reversed_row, col):
                     color = "#c7a355"
 
+                if any((reversed_row, col) in (old, new) for _, old, new in self.game.premoves):
+                    color = "#6d8cb0" if (reversed_row + col) % 2 == 0 else "#58779b"
+
                 if (reversed_row + col) % 2 == 0:
                     # White square
                     if self.selected_squares.__contains__((reversed_row, col)):
@@ -762,13 +1144,12 @@ class Client:
                 if self.game.get_piece_at((reversed_row, col)) is not None and self.game.get_piece_at((reversed_row, col)).piece is ChessPiece.KING and self.game.board.is_check():
                     color = "#ff1100"
 
-                square_x = board_x + col * square_size
-                square_y = board_y + row * square_size
-                square_rect = pygame.Rect(square_x, square_y, square_size, square_size)
+                square_rect = layout.square_rect(row, col)
+                square_x, square_y = square_rect.topleft
 
                 pygame.draw.rect(self.screen, color, square_rect)
         
-                if square_rect.collidepoint(pygame.mouse.get_pos()) and self.dragged_piece is not None:
+                if square_rect.collidepoint(mouse_pos) and self.dragged_piece is not None:
                     # Create a slightly smaller rectangle for the inner border
                     pygame.draw.rect(self.screen, "#cec3ba", square_rect, width=6)
 
@@ -783,47 +1164,28 @@ class Client:
                 if self.game is not None:
                     self.game.squares[(reversed_row, col)] = square_rect
 
-                center_x = square_x + square_size // 2
-                center_y = square_y + square_size // 2
-
-                for piece in self.game.one.pieces + self.game.two.pieces:
-                    if piece.location == (reversed_row, col): 
+        # Drawn between the squares and the pieces so the pieces stay untinted
+        if self.heatmap.visible:
+            self.screen.blit(self.heatmap.get_surface(self.game.board, square_size), (board_x, board_y))
 
-                        scaled_rect = piece.image.get_rect()
+        for piece in self.game.one.pieces + self.game.two.pieces:
+            if self.dragged_piece is not None and self.dragged_piece.location == piece.location:
+                continue
 
-                        offset_x = center_x - scaled_rect.width // 2
-                        offset_y = center_y - scaled_rect.height // 2
+            row, col = piece.location
+            scaled_rect = piece.get_image().get_rect()
 
-                        if self.dragged_piece is not None and self.dragged_piece.location == (reversed_row, col):
-                            continue
+            offset_x = board_x + col * square_size + square_size // 2 - scaled_rect.width // 2
+            offset_y = board_y + (7 - row) * square_size + square_size // 2 - scaled_rect.height // 2
 
-                        self.screen.blit(piece.image, (offset_x, offset_y))
+            self.screen.blit(piece.get_image(), (offset_x, offset_y))
 
         if self.dragged_piece is not None:
+            scaled_rect = self.dragged_piece.get_image().get_rect()
             offset_x = self.dragged_piece_pos[0] - scaled_rect.width // 2
             offset_y = self.dragged_piece_pos[1] - scaled_rect.height // 2
 
-            self.screen.blit(self.dragged_piece.image, (offset_x, offset_y))
-
-        for promoting in self.promoting:
-            if promoting.new_location is None:
-                continue
-            square_x = board_x + promoting.new_location[1] * square_size
-            square_y = board_y + promoting.new_location[0] * square_size
-            square_rect = pygame.Rect(square_x, square_y, square_size, square_size)
-
-            pygame.draw.rect(self.screen, "#ffffff", square_rect)
-
-            center_x = square_x + square_size // 2
-            center_y = square_y + square_size // 2
-
-            offset_x = center_x - scaled_rect.width // 2
-            offset_y = center_y - scaled_rect.height // 2
-
-            if self.dragged_piece is not None and self.dragged_piece.location == promoting.location:
-                continue
-
-            self.screen.blit(piece.image, (offset_x, offset_y))
+            self.screen.blit(self.dragged_piece.get_image(), (offset_x, offset_y))
 
         self.render_names(board_x, board_y, square_size)
 
@@ -859,22 +1221,31 @@ class Client:
             self.screen.blit(file_text, file_rect)
 
     def draw_controls(self):
-        square_size = min(screen_size[0] // 10, screen_size[1] // 10)
-        actual_board_width = square_size * 8
-
-        padding = (screen_size[0] - actual_board_width) // 4
-        controls_width = screen_size[0] // 10 * 4 - (padding)
-        controls_height = screen_size[1] // 10 * 8
+        controls_rect = self.layout.controls_rect
+        mouse_pos = self.mouse_pos()
 
-        controls_x = padding + actual_board_width
-        controls_y = (screen_size[1] - controls_height) // 2
-
-        controls_rect = pygame.Rect(controls_x, controls_y, controls_width, controls_height)
         pygame.draw.rect(self.screen, "#222222", controls_rect)
 
         if self.game is None:
             return
 
+        if self.games:
+            self.draw_simul()
+        else:
+            self.draw_moves(controls_rect, mouse_pos)
+
+        self.game.side_buttons.update_buttons()
+        self.game.side_buttons.draw(self.screen, mouse_pos)
+
+    def draw_simul(self):
+        # Mini-boards are only rendered again when their game changed, every other frame is one blit each
+        for game, mini_board, tile in zip(self.games, self.mini_boards, self.layout.tiles(len(self.games))):
+            surface = mini_board.get_surface(game, tile.width, game is self.game, self.is_waiting(game))
+            self.screen.blit(surface, tile)
+
+    def draw_moves(self, controls_rect: pygame.Rect, mouse_pos: tuple[int, int]):
+        controls_x, controls_y, controls_width, controls_height = controls_rect
+
         move_padding = 16
         font = pygame.font.SysFont(None, 22)
         
@@ -910,8 +1281,8 @@ class Client:
             pygame.draw.rect(self.screen, "#333333", scrollbar_rect)
 
         if pygame.mouse.get_pressed()[0]:
-            mouse_y = pygame.mouse.get_pos()[1]
-            if controls_rect.collidepoint(pygame.mouse.get_pos()):
+            mouse_y = mouse_pos[1]
+            if controls_rect.collidepoint(mouse_pos):
                 if mouse_y < controls_y + 10:
                     scroll_position = max(0, scroll_position - 10)
                 elif mouse_y > controls_y + controls_height - 10:
@@ -919,9 +1290,6 @@ class Client:
 
         self.scroll_position = max(0, min(scroll_position, len(self.game.moves) - max_lines * 2))
 
-        self.game.side_buttons.update_buttons()
-        self.game.side_buttons.draw(self.screen, pygame.mouse.get_pos())
-
 
     def update_cursor(self, mouse_pos):
         should_use_hand_cursor = any(button.is_hovered(mouse_pos) for button in self.game.side_buttons.buttons)
@@ -934,7 +1302,17 @@ class Client:
 
 
 
-client = Client()
+if __name__ == "__main__":
+    record_path = None
+    if "--record" in sys.argv:
+        # --record [path], every frame's input and engine replies for python -m util.Replay
+        index = sys.argv.index("--record") + 1
+        record_path = sys.argv[index] if index < len(sys.argv) and not sys.argv[index].startswith("--") else time.strftime("recordings/%Y%m%d-%H%M%S.jsonl.gz")
+
+    client = Client("--measure-startup" in sys.argv, record_path=record_path)
+
+    while client.active():
+        client.run()
 
-while client.active():
-    client.run()
\ No newline at end of file
+    # Closes the engine, the metrics exporter and the recording
+    client.quit()
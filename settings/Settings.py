@@ -1,13 +1,43 @@
-import toml
+import functools
 
 
-with open("settings/data.toml", 'r') as f:
-    config = toml.load(f)
+@functools.cache
+def load() -> dict:
+    # Parsed on first use instead of at import so the window can open first
+    import toml
+
+    with open("settings/data.toml", 'r') as f:
+        return toml.load(f)
 
 # Function to fetch a value from the configuration
 def get(key: str, value: str):
-    return config[key][value]
+    return load()[key][value]
+
+values = {
+    "screen_size": lambda: (get("display", "screen_x"), get("display", "screen_y")),
+    "render_scale": lambda: get("display", "render_scale"),
+    "max_fps": lambda: get("quality", "max_fps"),
+    "audio_buffer": lambda: get("audio", "buffer"),
+    "audio_channels": lambda: get("audio", "channels"),
+    "profiling_overlay": lambda: get("profiling", "overlay"),
+    "profiling_dump_every": lambda: get("profiling", "dump_every"),
+    "metrics_mode": lambda: get("metrics", "mode"),
+    "metrics_host": lambda: get("metrics", "host"),
+    "metrics_port": lambda: get("metrics", "port"),
+    "metrics_path": lambda: get("metrics", "path"),
+    "metrics_interval": lambda: get("metrics", "interval"),
+    "journal_path": lambda: get("journal", "path"),
+    "analysis_heatmap": lambda: get("analysis", "heatmap"),
+    "simul_boards": lambda: get("simul", "boards"),
+    "simul_engines": lambda: get("simul", "engines"),
+    "engine_memory": lambda: get("engine", "memory"),
+    "engine_threads": lambda: get("engine", "threads"),
+}
+
+def __getattr__(name: str):
+    if name not in values:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Example usage
-screen_size = (get("display", "screen_x"), get("display", "screen_y"))
-max_fps = get("quality", "max_fps")
+    value = values[name]()
+    globals()[name] = value
+    return value
@@ -0,0 +1,615 @@
+import hashlib
+import io
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from collections import deque
+
+import chess
+import chess.engine
+import chess.pgn
+
+from util.Engine import EngineProcess, hash_per_engine
+
+
+LEASE_SECONDS = 120
+MATE_SCORE = 100000
+
+# Centipawns lost by the move, from the mover's point of view
+ANNOTATIONS = [(300, chess.pgn.NAG_BLUNDER), (100, chess.pgn.NAG_MISTAKE), (50, chess.pgn.NAG_DUBIOUS_MOVE)]
+
+def make_job(kind: str, payload: str, limit: dict, multipv: int = 1, order: list = None) -> dict:
+    # The id only depends on what is analysed and how, so submitting the same archive twice adds nothing
+    key = json.dumps({"kind": kind, "payload": payload, "limit": limit, "multipv": multipv}, sort_keys=True)
+    return {
+        "id": hashlib.sha256(key.encode()).hexdigest()[:20],
+        "kind": kind,
+        "payload": payload,
+        "limit": limit,
+        "multipv": multipv,
+        "order": order or [],
+    }
+
+def game_jobs(path: str, limit: dict):
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        index = 0
+        while True:
+            game = chess.pgn.read_game(f)
+            if game is None:
+                break
+
+            if not game.errors:
+                pgn = game.accept(chess.pgn.StringExporter(headers=True, variations=False, comments=False))
+                yield make_job("game", pgn, limit, order=[os.path.abspath(path), index])
+            index += 1
+
+def position_jobs(path: str, limit: dict, multipv: int):
+    # One FEN (or EPD) per line
+    with open(path, "r") as f:
+        for index, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                board = chess.Board(line)
+            except ValueError:
+                board, _ = chess.Board.from_epd(line)
+            yield make_job("position", board.fen(), limit, multipv, order=[os.path.abspath(path), index])
+
+def encode_score(score: chess.engine.PovScore) -> dict:
+    white = score.white()
+    return {"mate": white.mate()} if white.is_mate() else {"cp": white.score()}
+
+def decode_score(data: dict) -> chess.engine.PovScore:
+    score = chess.engine.Mate(data["mate"]) if "mate" in data else chess.engine.Cp(data["cp"])
+    return chess.engine.PovScore(score, chess.WHITE)
+
+def encode_line(info: dict) -> dict:
+    return {
+        "score": encode_score(info["score"]),
+        "depth": info.get("depth"),
+        "nodes": info.get("nodes"),
+        "pv": [move.uci() for move in info.get("pv", [])],
+    }
+
+class JobTable:
+    # The coordinator's state: every job, the pending order, the leases and the results
+    def __init__(self, lease_seconds: float = LEASE_SECONDS, journal: str = None):
+        self.lease_seconds = lease_seconds
+        self.jobs: dict[str, dict] = {}
+        self.pending: deque[str] = deque()
+        self.leases: dict[str, tuple[str, float]] = {}
+        self.results: dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.journal = None
+
+        if journal is not None:
+            # Replaying the journal lets a restarted coordinator carry on where it stopped
+            if os.path.exists(journal):
+                self.load(journal)
+            self.journal = open(journal, "a")
+
+    def load(self, path: str):
+        with open(path, "r") as f:
+            for line in f:
+                entry = json.loads(line)
+                if "submit" in entry:
+                    job = entry["submit"]
+                    if job["id"] not in self.jobs:
+                        self.jobs[job["id"]] = job
+                        self.pending.append(job["id"])
+                elif "done" in entry:
+                    self.results[entry["done"]] = entry["result"]
+
+    def log(self, entry: dict):
+        if self.journal is not None:
+            self.journal.write(json.dumps(entry) + "\n")
+            self.journal.flush()
+
+    def submit(self, jobs: list[dict]) -> int:
+        added = 0
+        with self.lock:
+            for job in jobs:
+                if job["id"] in self.jobs:
+                    continue
+
+                self.jobs[job["id"]] = job
+                self.pending.append(job["id"])
+                self.log({"submit": job})
+                added += 1
+        return added
+
+    def lease(self, worker: str) -> dict | None:
+        with self.lock:
+            now = time.time()
+
+            # Jobs of workers that went silent go back to the front of the queue
+            for job_id, (_, deadline) in list(self.leases.items()):
+                if deadline < now:
+                    del self.leases[job_id]
+                    self.pending.appendleft(job_id)
+
+            while self.pending:
+                job_id = self.pending.popleft()
+                if job_id in self.results or job_id in self.leases:
+                    continue
+
+                self.leases[job_id] = (worker, now + self.lease_seconds)
+                return self.jobs[job_id]
+
+        return None
+
+    def renew(self, job_id: str, worker: str) -> bool:
+        with self.lock:
+            lease = self.leases.get(job_id)
+            if lease is None or lease[0] != worker:
+                return False
+
+            self.leases[job_id] = (worker, time.time() + self.lease_seconds)
+            return True
+
+    def complete(self, job_id: str, worker: str, result: dict) -> bool:
+        # The first result wins, a late worker whose lease expired is told its result wasn't needed
+        with self.lock:
+            if job_id not in self.jobs or job_id in self.results:
+                return False
+
+            self.results[job_id] = result
+            self.leases.pop(job_id, None)
+            self.log({"done": job_id, "result": result})
+            return True
+
+    def status(self) -> dict:
+        with self.lock:
+            return {"jobs": len(self.jobs), "pending": len(self.jobs) - len(self.results) - len(self.leases), "leased": len(self.leases), "done": len(self.results)}
+
+    def collect(self) -> list[list[dict]]:
+        with self.lock:
+            return [[self.jobs[job_id], result] for job_id, result in self.results.items()]
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    operations = {"submit", "lease", "renew", "complete", "status", "collect"}
+
+    def handle(self):
+        # One JSON request per line, answered with one JSON line
+        for line in self.rfile:
+            # A bad request gets an error reply instead of dropping the connection, which the worker would take for a dead coordinator
+            try:
+                request = json.loads(line)
+                operation = request.pop("op", None) if isinstance(request, dict) else None
+
+                if operation in self.operations:
+                    response = {"result": getattr(self.server.table, operation)(**request)}
+                else:
+                    response = {"error": f"unknown operation {operation!r}"}
+            except (ValueError, TypeError, KeyError) as e:
+                response = {"error": f"bad request: {e!r}"}
+
+            self.wfile.write((json.dumps(response) + "\n").encode())
+
+class Coordinator(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: tuple[str, int], table: JobTable):
+        self.table = table
+        super().__init__(address, RequestHandler)
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+class RemoteQueue:
+    def __init__(self, host: str, port: int):
+        self.address = (host, port)
+        self.connection: socket.socket = None
+        self.file = None
+        self.lock = threading.Lock()
+
+    def call(self, operation: str, **arguments):
+        request = (json.dumps(dict(arguments, op=operation)) + "\n").encode()
+
+        with self.lock:
+            # Reconnect once if the coordinator restarted in between
+            for attempt in range(2):
+                try:
+                    if self.connection is None:
+                        self.connection = socket.create_connection(self.address)
+                        self.file = self.connection.makefile("rb")
+
+                    self.connection.sendall(request)
+                    line = self.file.readline()
+                    if not line:
+                        raise ConnectionError("coordinator closed the connection")
+                    break
+                except OSError:
+                    self.close()
+                    if attempt == 1:
+                        raise
+
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response["result"]
+
+    def submit(self, jobs: list[dict]) -> int:
+        return self.call("submit", jobs=jobs)
+
+    def lease(self, worker: str) -> dict | None:
+        return self.call("lease", worker=worker)
+
+    def renew(self, job_id: str, worker: str) -> bool:
+        return self.call("renew", job_id=job_id, worker=worker)
+
+    def complete(self, job_id: str, worker: str, result: dict) -> bool:
+        return self.call("complete", job_id=job_id, worker=worker, result=result)
+
+    def status(self) -> dict:
+        return self.call("status")
+
+    def collect(self) -> list[list[dict]]:
+        return self.call("collect")
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = None
+        self.file = None
+
+class FileQueue:
+    # A job is a file moving from pending/ to leased/ to done/, a rename is the lock, so any number of
+    # workers can share the folder (on one machine or a shared file system) without a coordinator
+    def __init__(self, folder: str, lease_seconds: float = LEASE_SECONDS):
+        self.folder = folder
+        self.lease_seconds = lease_seconds
+        for name in ("pending", "leased", "done"):
+            os.makedirs(os.path.join(folder, name), exist_ok=True)
+
+    def path(self, state: str, job_id: str) -> str:
+        return os.path.join(self.folder, state, f"{job_id}.json")
+
+    def write(self, path: str, data: dict):
+        temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(data, f)
+        os.replace(temporary, path)
+
+    def submit(self, jobs: list[dict]) -> int:
+        added = 0
+        for job in jobs:
+            if any(os.path.exists(self.path(state, job["id"])) for state in ("pending", "leased", "done")):
+                continue
+
+            self.write(self.path("pending", job["id"]), job)
+            added += 1
+        return added
+
+    def expire(self):
+        now = time.time()
+        for name in os.listdir(os.path.join(self.folder, "leased")):
+            path = os.path.join(self.folder, "leased", name)
+            try:
+                if os.path.getmtime(path) + self.lease_seconds < now:
+                    os.rename(path, os.path.join(self.folder, "pending", name))
+            except FileNotFoundError:
+                pass
+
+    def lease(self, worker: str) -> dict | None:
+        self.expire()
+
+        for name in sorted(os.listdir(os.path.join(self.folder, "pending"))):
+            if not name.endswith(".json"):
+                continue
+
+            job_id = name[:-5]
+            try:
+                # The lease starts at the file's modification time
+                os.utime(self.path("pending", job_id))
+                os.rename(self.path("pending", job_id), self.path("leased", job_id))
+            except FileNotFoundError:
+                # Another worker got it first
+                continue
+
+            with open(self.path("leased", job_id), "r") as f:
+                return json.load(f)
+
+        return None
+
+    def renew(self, job_id: str, worker: str) -> bool:
+        try:
+            os.utime(self.path("leased", job_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def complete(self, job_id: str, worker: str, result: dict) -> bool:
+        done = self.path("done", job_id)
+        if os.path.exists(done):
+            return False
+
+        for state in ("leased", "pending"):
+            try:
+                with open(self.path(state, job_id), "r") as f:
+                    job = json.load(f)
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            return False
+
+        self.write(done, {"job": job, "result": result})
+        for state in ("leased", "pending"):
+            try:
+                os.remove(self.path(state, job_id))
+            except FileNotFoundError:
+                pass
+        return True
+
+    def status(self) -> dict:
+        counts = {state: sum(name.endswith(".json") for name in os.listdir(os.path.join(self.folder, state))) for state in ("pending", "leased", "done")}
+        counts["jobs"] = sum(counts.values())
+        return counts
+
+    def collect(self) -> list[list[dict]]:
+        results = []
+        for name in os.listdir(os.path.join(self.folder, "done")):
+            if name.endswith(".json"):
+                with open(os.path.join(self.folder, "done", name), "r") as f:
+                    entry = json.load(f)
+                results.append([entry["job"], entry["result"]])
+        return results
+
+def open_queue(spec: str, lease_seconds: float = LEASE_SECONDS):
+    # tcp://host:port for a coordinator, anything else is a queue folder
+    if spec.startswith("tcp://"):
+        host, _, port = spec[len("tcp://"):].rpartition(":")
+        return RemoteQueue(host or "127.0.0.1", int(port))
+    return FileQueue(spec, lease_seconds)
+
+class Worker:
+    def __init__(self, queue, engine_path: str, options: dict = None, name: str = None):
+        self.queue = queue
+        # One engine for the worker's lifetime, each job starts with ucinewgame (a fresh hash) but skips the launch and network load
+        self.engine = EngineProcess(engine_path, options)
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+    def run(self, exit_when_idle: bool = False, poll: float = 1.0) -> int:
+        completed = 0
+        while True:
+            job = self.queue.lease(self.name)
+            if job is None:
+                if exit_when_idle:
+                    break
+                time.sleep(poll)
+                continue
+
+            result = self.analyse(job)
+            if self.queue.complete(job["id"], self.name, result):
+                completed += 1
+
+        return completed
+
+    def analyse(self, job: dict) -> dict:
+        limit = chess.engine.Limit(**job["limit"])
+
+        if job["kind"] == "position":
+            infos = self.engine.analyse(chess.Board(job["payload"]), limit, job["multipv"], job["id"])
+            return {"lines": [encode_line(info) for info in infos]}
+
+        game = chess.pgn.read_game(io.StringIO(job["payload"]))
+        board = game.board()
+        positions = []
+
+        # Every position including the final one, the move annotations compare neighbours
+        for move in [None] + [node.move for node in game.mainline()]:
+            if move is not None:
+                board.push(move)
+
+            if board.is_game_over():
+                positions.append({"lines": [], "result": board.result()})
+            else:
+                infos = self.engine.analyse(board, limit, job["multipv"], job["id"])
+                positions.append({"lines": [encode_line(info) for info in infos]})
+
+            self.queue.renew(job["id"], self.name)
+
+        return {"positions": positions}
+
+    def quit(self):
+        self.engine.quit()
+
+def position_value(position: dict, color: chess.Color) -> int | None:
+    if position["lines"]:
+        return decode_score(position["lines"][0]["score"]).pov(color).score(mate_score=MATE_SCORE)
+
+    # Checkmate or a draw by rule, there is nothing to search
+    result = position.get("result")
+    if result == "1/2-1/2":
+        return 0
+    if result in ("1-0", "0-1"):
+        return MATE_SCORE if (result == "1-0") == (color == chess.WHITE) else -MATE_SCORE
+    return None
+
+def annotate(job: dict, result: dict) -> chess.pgn.Game:
+    game = chess.pgn.read_game(io.StringIO(job["payload"]))
+    positions = result["positions"]
+    nodes = list(game.mainline())
+
+    for i, node in enumerate(nodes):
+        before, after = positions[i], positions[i + 1]
+        mover = not node.turn()
+
+        if after["lines"]:
+            node.set_eval(decode_score(after["lines"][0]["score"]), after["lines"][0]["depth"])
+
+        value_before, value_after = position_value(before, mover), position_value(after, mover)
+        if value_before is None or value_after is None or not before["lines"]:
+            continue
+
+        # Capped so a mate in 12 turning into a mate in 14 isn't a blunder
+        loss = min(value_before, 1000) - min(value_after, 1000)
+        best = [chess.Move.from_uci(uci) for uci in before["lines"][0]["pv"]]
+        if not best or best[0] == node.move:
+            continue
+
+        for threshold, nag in ANNOTATIONS:
+            if loss >= threshold:
+                node.nags.add(nag)
+                variation = node.parent.add_variation(best[0], comment=f"best, {loss} cp better")
+                variation.add_line(best[1:8])
+                break
+
+    game.headers["Annotator"] = "chess-client analysis"
+    return game
+
+def write_results(results: list[list[dict]], pgn_path: str = None, positions_path: str = None) -> tuple[int, int]:
+    results = sorted(results, key=lambda entry: entry[0].get("order") or [])
+    games = positions = 0
+
+    if pgn_path is not None:
+        with open(pgn_path, "w") as f:
+            for job, result in results:
+                if job["kind"] == "game":
+                    print(annotate(job, result), file=f, end="\n\n")
+                    games += 1
+
+    if positions_path is not None:
+        with open(positions_path, "w") as f:
+            for job, result in results:
+                if job["kind"] == "position":
+                    f.write(json.dumps({"fen": job["payload"], "lines": result["lines"]}) + "\n")
+                    positions += 1
+
+    return games, positions
+
+if __name__ == "__main__":
+    import argparse
+    import subprocess
+    import sys
+
+    parser = argparse.ArgumentParser(description="Analyse game archives with any number of workers sharing one job queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_limit(command):
+        command.add_argument("--depth", type=int, help="search depth per position")
+        command.add_argument("--nodes", type=int, help="nodes per position")
+        command.add_argument("--time", type=float, help="seconds per position")
+        command.add_argument("--multipv", type=int, default=1, help="lines per position job")
+
+    def add_engine(command):
+        command.add_argument("--engine", help="engine binary, defaults to the best cached build")
+        command.add_argument("--threads", type=int, default=1, help="engine Threads")
+        command.add_argument("--hash", type=int, default=64, help="engine Hash in MB")
+        command.add_argument("--numa", default="auto", help="engine NumaPolicy (auto, none, system, hardware or a custom mapping)")
+
+    serve = commands.add_parser("serve", help="run a coordinator that workers connect to")
+    serve.add_argument("--host", default="127.0.0.1", help="address to listen on, the queue has no authentication so only use 0.0.0.0 on a trusted network")
+    serve.add_argument("--port", type=int, default=9200)
+    serve.add_argument("--lease", type=float, default=LEASE_SECONDS, help="seconds before a silent worker's job is handed out again")
+    serve.add_argument("--journal", help="append submitted jobs and results here so a restart resumes")
+
+    submit = commands.add_parser("submit", help="queue games and positions")
+    submit.add_argument("--queue", required=True, help="tcp://host:port or a queue folder")
+    submit.add_argument("--games", nargs="*", default=[], help="PGN files, one job per game")
+    submit.add_argument("--positions", nargs="*", default=[], help="files with one FEN per line, one job per position")
+    add_limit(submit)
+
+    work = commands.add_parser("work", help="pull and analyse jobs until stopped")
+    work.add_argument("--queue", required=True)
+    work.add_argument("--lease", type=float, default=LEASE_SECONDS, help="lease length for a queue folder")
+    work.add_argument("--exit-when-idle", action="store_true", help="stop once the queue has nothing left to hand out")
+    add_engine(work)
+
+    collect = commands.add_parser("collect", help="merge the finished results into an annotated PGN")
+    collect.add_argument("--queue", required=True)
+    collect.add_argument("--output", default="analysis.pgn", help="annotated games")
+    collect.add_argument("--positions-output", default="positions.jsonl", help="position results, one JSON object per line")
+
+    local = commands.add_parser("local", help="coordinator, submit, workers and collect in one go on this machine")
+    local.add_argument("--games", nargs="*", default=[])
+    local.add_argument("--positions", nargs="*", default=[])
+    local.add_argument("--workers", type=int, default=2, help="worker processes")
+    local.add_argument("--memory", type=int, help="MB for all workers' engines together, sets --hash per worker from this budget")
+    local.add_argument("--queue", help="use this queue folder instead of a coordinator on a local port")
+    local.add_argument("--output", default="analysis.pgn")
+    local.add_argument("--positions-output", default="positions.jsonl")
+    add_limit(local)
+    add_engine(local)
+
+    args = parser.parse_args()
+
+    def limit_of(args) -> dict:
+        limit = {name: getattr(args, name) for name in ("depth", "nodes", "time") if getattr(args, name) is not None}
+        return limit or {"depth": 16}
+
+    def jobs_of(args) -> list[dict]:
+        limit = limit_of(args)
+        jobs = [job for path in args.games for job in game_jobs(path, limit)]
+        jobs += [job for path in args.positions for job in position_jobs(path, limit, args.multipv)]
+        return jobs
+
+    def engine_path(args) -> str:
+        from util.Build import find_engine
+
+        path = args.engine or find_engine()
+        if path is None:
+            sys.exit("No engine binary found, build one with python -m util.Build or pass --engine")
+        return path
+
+    if args.command == "serve":
+        coordinator = Coordinator((args.host, args.port), JobTable(args.lease, args.journal))
+        print(f"Coordinator listening on {args.host}:{coordinator.server_address[1]}")
+        coordinator.serve_forever()
+
+    elif args.command == "submit":
+        jobs = jobs_of(args)
+        added = open_queue(args.queue).submit(jobs)
+        print(f"Queued {added} new jobs ({len(jobs) - added} already known)")
+
+    elif args.command == "work":
+        worker = Worker(open_queue(args.queue, args.lease), engine_path(args), {"Threads": args.threads, "Hash": args.hash, "NumaPolicy": args.numa})
+        try:
+            print(f"{worker.name} completed {worker.run(args.exit_when_idle)} jobs")
+        finally:
+            worker.quit()
+
+    elif args.command == "collect":
+        queue = open_queue(args.queue)
+        games, positions = write_results(queue.collect(), args.output, args.positions_output)
+        print(f"Wrote {games} games to {args.output} and {positions} positions to {args.positions_output} ({queue.status()})")
+
+    elif args.command == "local":
+        start = time.perf_counter()
+        coordinator = None
+
+        if args.queue:
+            spec = args.queue
+        else:
+            coordinator = Coordinator(("127.0.0.1", 0), JobTable())
+            coordinator.start()
+            spec = f"tcp://127.0.0.1:{coordinator.server_address[1]}"
+
+        queue = open_queue(spec)
+        jobs = jobs_of(args)
+        queue.submit(jobs)
+
+        if args.memory:
+            args.hash = hash_per_engine(args.memory, args.workers)
+
+        command = [sys.executable, "-m", "util.Analysis", "work", "--queue", spec, "--exit-when-idle", "--engine", engine_path(args),
+                   "--threads", str(args.threads), "--hash", str(args.hash), "--numa", args.numa]
+        workers = [subprocess.Popen(command) for _ in range(args.workers)]
+        for process in workers:
+            process.wait()
+
+        games, positions = write_results(queue.collect(), args.output, args.positions_output)
+        print(f"{len(jobs)} jobs on {args.workers} workers in {time.perf_counter() - start:.1f}s: {games} games to {args.output}, {positions} positions to {args.positions_output}")
+
+        if coordinator is not None:
+            coordinator.shutdown()
@@ -0,0 +1,211 @@
+import glob
+import hashlib
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+
+SOURCE_FOLDER = "engine/src"
+CACHE_FOLDER = "engine/build"
+
+# Fastest first, each entry lists the cpu flags it needs (as named in /proc/cpuinfo)
+X86_ARCHES = [
+    ("x86-64-vnni512", {"avx512f", "avx512bw", "avx512dq", "avx512vl", "avx512_vnni"}),
+    # Same instructions with 256 bit operands, for cores that downclock on 512 bit vectors; --all benchmarks both
+    ("x86-64-vnni256", {"avx512f", "avx512bw", "avx512dq", "avx512vl", "avx512_vnni"}),
+    ("x86-64-avx512", {"avx512f", "avx512bw"}),
+    ("x86-64-avxvnni", {"avx_vnni", "avx2", "bmi2"}),
+    ("x86-64-bmi2", {"avx2", "bmi2"}),
+    ("x86-64-avx2", {"avx2"}),
+    ("x86-64-sse41-popcnt", {"sse4_1", "popcnt"}),
+    ("x86-64-ssse3", {"ssse3"}),
+    ("x86-64-sse3-popcnt", {"pni", "popcnt"}),
+    ("x86-64", set()),
+]
+
+ARM_ARCHES = [
+    ("armv8-dotprod", {"asimddp"}),
+    ("armv8", set()),
+]
+
+def read_cpuinfo() -> tuple[set[str], dict[str, str]]:
+    flags = set()
+    fields = {}
+
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+
+                if key in ("flags", "Features"):
+                    flags.update(value.split())
+                elif key and key not in fields:
+                    fields[key] = value.strip()
+    except OSError:
+        pass
+
+    return flags, fields
+
+def supported_arches() -> list[str]:
+    machine = platform.machine().lower()
+    flags, fields = read_cpuinfo()
+
+    if machine in ("x86_64", "amd64"):
+        # pext/pdep are microcoded on AMD before Zen 3, bmi2 builds are slower there
+        slow_pext = fields.get("vendor_id") == "AuthenticAMD" and int(fields.get("cpu family", "0")) < 25
+        return [arch for arch, needed in X86_ARCHES if needed <= flags and not (slow_pext and "bmi2" in needed)]
+
+    if machine in ("aarch64", "arm64"):
+        return [arch for arch, needed in ARM_ARCHES if needed <= flags]
+
+    return ["general-64" if sys.maxsize > 2 ** 32 else "general-32"]
+
+def detect_arch() -> str:
+    return supported_arches()[0]
+
+def source_hash(source: str = SOURCE_FOLDER) -> str:
+    digest = hashlib.sha256()
+
+    paths = glob.glob(os.path.join(source, "**", "*.cpp"), recursive=True)
+    paths += glob.glob(os.path.join(source, "**", "*.h"), recursive=True)
+    paths.append(os.path.join(source, "Makefile"))
+
+    for path in sorted(paths):
+        digest.update(os.path.relpath(path, source).replace(os.sep, "/").encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()[:16]
+
+def run_bench(binary: str) -> dict:
+    # Stockfish writes the bench summary to stderr
+    result = subprocess.run([binary, "bench"], capture_output=True, text=True)
+    output = result.stdout + result.stderr
+
+    nodes = re.search(r"Nodes searched\s*:\s*(\d+)", output)
+    nps = re.search(r"Nodes/second\s*:\s*(\d+)", output)
+
+    return {
+        "ok": result.returncode == 0 and nodes is not None and nps is not None,
+        "nodes": int(nodes.group(1)) if nodes else None,
+        "nps": int(nps.group(1)) if nps else None,
+    }
+
+def load_manifests(cache: str = CACHE_FOLDER) -> list[dict]:
+    manifests = []
+    for path in glob.glob(os.path.join(cache, "*", "build.json")):
+        with open(path, "r") as f:
+            manifests.append(json.load(f))
+    return manifests
+
+def build(arch: str = None, pgo: bool = True, jobs: int = None, source: str = SOURCE_FOLDER, cache: str = CACHE_FOLDER, force: bool = False) -> dict:
+    arch = arch or detect_arch()
+    digest = source_hash(source)
+    folder = os.path.join(cache, f"{arch}-{digest}")
+    manifest_path = os.path.join(folder, "build.json")
+
+    if os.path.exists(manifest_path) and not force:
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+
+    work = os.path.join(folder, "src")
+    shutil.rmtree(work, ignore_errors=True)
+    shutil.copytree(source, work, ignore=shutil.ignore_patterns("*.o", "*.gcda", "stockfish", "stockfish.exe"))
+
+    # Reuse networks from earlier builds so `make net` doesn't download them again
+    nets = os.path.join(cache, "nets")
+    for net in glob.glob(os.path.join(nets, "*.nnue")):
+        shutil.copy2(net, work)
+
+    command = ["make", f"-j{jobs or os.cpu_count() or 1}", "profile-build" if pgo else "build", f"ARCH={arch}"]
+    print(f"Building {arch} ({digest}): {' '.join(command)}")
+
+    start = time.perf_counter()
+    subprocess.run(command, cwd=work, check=True)
+    build_time = time.perf_counter() - start
+
+    os.makedirs(nets, exist_ok=True)
+    for net in glob.glob(os.path.join(work, "*.nnue")):
+        shutil.copy2(net, nets)
+
+    binary = os.path.join(folder, "stockfish")
+    shutil.copy2(os.path.join(work, "stockfish"), binary)
+    shutil.rmtree(work, ignore_errors=True)
+
+    manifest = {
+        "arch": arch,
+        "source_hash": digest,
+        "path": binary,
+        "pgo": pgo,
+        "build_seconds": round(build_time, 1),
+        "built_at": time.time(),
+    }
+    manifest.update(verify(binary, digest, cache))
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+def verify(binary: str, digest: str, cache: str = CACHE_FOLDER) -> dict:
+    bench = run_bench(binary)
+
+    # Every arch built from the same source must search the same bench node count
+    signatures = {m["nodes"] for m in load_manifests(cache) if m["source_hash"] == digest and m.get("verified")}
+    consistent = not signatures or bench["nodes"] in signatures
+
+    return {
+        "verified": bench["ok"] and consistent,
+        "nodes": bench["nodes"],
+        "nps": bench["nps"],
+    }
+
+def find_engine(default: str = None, cache: str = CACHE_FOLDER, source: str = SOURCE_FOLDER) -> str | None:
+    if sys.platform == "win32" or not os.path.isdir(cache):
+        return default
+
+    digest = source_hash(source) if os.path.isdir(source) else None
+    usable = set(supported_arches())
+
+    candidates = [
+        m for m in load_manifests(cache)
+        if m.get("verified") and m["arch"] in usable and os.path.exists(m["path"])
+        and (digest is None or m["source_hash"] == digest)
+    ]
+
+    if not candidates:
+        return default
+
+    return max(candidates, key=lambda m: m["nps"])["path"]
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build, verify and cache Stockfish binaries for this host")
+    parser.add_argument("--arch", help="Makefile ARCH to build, defaults to the best one for this cpu")
+    parser.add_argument("--all", action="store_true", help="build every ARCH this cpu supports and keep the fastest")
+    parser.add_argument("--no-pgo", action="store_true", help="use the plain build target instead of profile-build")
+    parser.add_argument("--jobs", type=int, help="parallel make jobs")
+    parser.add_argument("--force", action="store_true", help="rebuild even if a cached binary exists")
+    parser.add_argument("--list", action="store_true", help="list cached builds and exit")
+    args = parser.parse_args()
+
+    if not args.list:
+        arches = supported_arches() if args.all else [args.arch or detect_arch()]
+        for arch in arches:
+            try:
+                build(arch, pgo=not args.no_pgo, jobs=args.jobs, force=args.force)
+            except subprocess.CalledProcessError as e:
+                print(f"Build for {arch} failed: {e}")
+
+    for manifest in sorted(load_manifests(), key=lambda m: m.get("nps") or 0, reverse=True):
+        status = "verified" if manifest.get("verified") else "FAILED"
+        print(f"{manifest['arch']:<22} {manifest['source_hash']} {status:<8} {manifest.get('nps') or 0:>12} nps  {manifest['path']}")
+
+    print(f"Selected: {find_engine()}")
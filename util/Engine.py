@@ -0,0 +1,345 @@
+import threading
+import time
+
+from util.Metrics import engine_bestmove_seconds, engine_depth, engine_errors, engine_hash_bytes, engine_hashfull, engine_huge_pages_bytes, engine_moves, engine_new_games, engine_nodes, engine_nps, engine_queue_depth, engine_restarts, engine_rss_bytes, engine_seldepth
+from util.Profiler import profiler
+
+
+# Memory an engine needs besides Hash: the NNUE networks, thread stacks and the binary (about 230 MB resident for Stockfish 17)
+ENGINE_OVERHEAD_MB = 240
+
+def hash_per_engine(budget_mb: int, engines: int, overhead_mb: int = ENGINE_OVERHEAD_MB) -> int:
+    return max(1, (budget_mb - engines * overhead_mb) // max(1, engines))
+
+def engine_options(budget_mb: int, engines: int, threads: int = 1) -> dict:
+    # Explicit Threads so several engines on one host don't each assume they own the machine
+    return {"Threads": max(1, threads), "Hash": hash_per_engine(budget_mb, engines)}
+
+def read_proc(path: str, fields: set[str]) -> dict[str, int]:
+    # "Name:   1234 kB" lines in bytes, empty where there is no /proc
+    values = {}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in fields:
+                    values[name] = int(rest.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return values
+
+def process_memory(pid: int) -> dict:
+    status = read_proc(f"/proc/{pid}/status", {"VmRSS", "VmHWM"})
+    rollup = read_proc(f"/proc/{pid}/smaps_rollup", {"AnonHugePages"})
+
+    return {
+        "rss": status.get("VmRSS"),
+        "peak": status.get("VmHWM"),
+        "huge_pages": rollup.get("AnonHugePages"),
+    }
+
+def transparent_huge_pages() -> str | None:
+    # memory.cpp asks for huge pages with madvise, the kernel only grants them in the always and madvise modes
+    try:
+        with open("/sys/kernel/mm/transparent_hugepage/enabled", "r") as f:
+            text = f.read()
+    except OSError:
+        return None
+    return text[text.index("[") + 1:text.index("]")] if "[" in text else text.strip()
+
+
+class EngineProcess:
+    def __init__(self, path: str, options: dict = None):
+        self.path = path
+        self.options = options or {}
+        self.engine = None
+        self.error: Exception = None
+        self.ready = threading.Event()
+        self.ready_at: float = None
+        self.lock = threading.Lock()
+        self.thread: threading.Thread = None
+        self.game: object = None
+
+    @property
+    def pid(self) -> int | None:
+        engine = self.engine
+        return engine.protocol.transport.get_pid() if engine is not None else None
+
+    def start(self):
+        # Spawning the process, loading the NNUE file and the isready round trip all happen off the main thread
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.launch, daemon=True)
+            self.thread.start()
+
+    def launch(self):
+        import chess.engine
+
+        try:
+            engine = chess.engine.SimpleEngine.popen_uci(self.path)
+            if self.options:
+                # Older builds lack some options (NumaPolicy), skip those instead of failing the launch
+                engine.configure({name: value for name, value in self.options.items() if name in engine.options})
+            engine.ping()
+            self.engine = engine
+            self.game = None
+            self.observe_memory()
+        except (OSError, chess.engine.EngineError) as e:
+            self.error = e
+            engine_errors.inc(stage="launch")
+            print(f"Failed to start engine {self.path}: {e}")
+
+        self.ready_at = time.perf_counter()
+        self.ready.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        self.start()
+        return self.ready.wait(timeout)
+
+    def play(self, board, time_limit: float = 2.0, game: object = None):
+        engine_queue_depth.inc()
+        try:
+            return self.search(board, time_limit, game)
+        finally:
+            engine_queue_depth.dec()
+
+    def search(self, board, time_limit: float = 2.0, game: object = None):
+        import chess.engine
+
+        self.wait()
+        if self.engine is None:
+            raise self.error
+
+        try:
+            with self.lock:
+                start = time.perf_counter()
+                self.switch_game(game)
+                try:
+                    result = self.engine.play(board, chess.engine.Limit(time=time_limit), info=chess.engine.INFO_BASIC, game=game)
+                except chess.engine.EngineTerminatedError:
+                    # The process died, bring up a fresh one and retry the search once
+                    engine_restarts.inc()
+                    self.restart()
+                    result = self.engine.play(board, chess.engine.Limit(time=time_limit), info=chess.engine.INFO_BASIC, game=game)
+
+                elapsed = time.perf_counter() - start
+        except chess.engine.EngineError:
+            engine_errors.inc(stage="search")
+            raise
+
+        profiler.record("engine", elapsed)
+        self.observe(result.info, elapsed)
+
+        return result.move
+
+    def analyse(self, board, limit, multipv: int = 1, game: object = None) -> list[dict]:
+        import chess.engine
+
+        self.wait()
+        if self.engine is None:
+            raise self.error
+
+        with self.lock:
+            self.switch_game(game)
+            try:
+                infos = self.engine.analyse(board, limit, multipv=multipv, game=game)
+            except chess.engine.EngineTerminatedError:
+                engine_restarts.inc()
+                self.restart()
+                infos = self.engine.analyse(board, limit, multipv=multipv, game=game)
+            except chess.engine.EngineError:
+                engine_errors.inc(stage="analyse")
+                raise
+
+        return infos
+
+    def switch_game(self, game: object):
+        # python-chess sends ucinewgame whenever `game` changes, so the process and its loaded networks are kept
+        if game != self.game:
+            # The first game of a process isn't a reuse
+            if self.game is not None:
+                engine_new_games.inc()
+            self.game = game
+
+    def memory(self) -> dict:
+        pid = self.pid
+        memory = process_memory(pid) if pid is not None else {"rss": None, "peak": None, "huge_pages": None}
+
+        hash_mb = self.options.get("Hash")
+        if hash_mb is None and self.engine is not None and "Hash" in self.engine.options:
+            hash_mb = self.engine.options["Hash"].default
+
+        memory.update({"pid": pid, "hash": hash_mb * 1024 * 1024 if hash_mb else None, "threads": self.options.get("Threads")})
+        return memory
+
+    def observe_memory(self):
+        memory = self.memory()
+        if memory["pid"] is None:
+            return
+
+        for gauge, key in ((engine_rss_bytes, "rss"), (engine_hash_bytes, "hash"), (engine_huge_pages_bytes, "huge_pages")):
+            if memory[key] is not None:
+                gauge.set(memory[key], pid=memory["pid"])
+
+    def forget_memory(self, pid: int):
+        # A dead process would otherwise keep exporting its last values and inflate the summed RSS
+        for gauge in (engine_rss_bytes, engine_hash_bytes, engine_huge_pages_bytes):
+            gauge.remove(pid=pid)
+
+    def restart(self):
+        import chess.engine
+
+        self.forget_memory(self.pid)
+        try:
+            self.engine.close()
+        except chess.engine.EngineError:
+            pass
+
+        self.engine = None
+        self.launch()
+
+        if self.engine is None:
+            raise self.error
+
+    def observe(self, info: dict, elapsed: float):
+        engine_moves.inc()
+        engine_bestmove_seconds.observe(elapsed)
+
+        if "nps" in info:
+            engine_nps.set(info["nps"])
+        if "depth" in info:
+            engine_depth.set(info["depth"])
+        if "seldepth" in info:
+            engine_seldepth.set(info["seldepth"])
+        if "hashfull" in info:
+            engine_hashfull.set(info["hashfull"])
+        if "nodes" in info:
+            engine_nodes.inc(info["nodes"])
+
+        self.observe_memory()
+
+    def quit(self):
+        if self.engine is not None:
+            with self.lock:
+                self.forget_memory(self.pid)
+                self.engine.quit()
+            self.engine = None
+
+class EnginePool:
+    # Searches for any number of games share `size` engine processes, extra requests wait for one to be idle
+    def __init__(self, path: str, size: int, options: dict = None):
+        self.engines = [EngineProcess(path, options) for _ in range(max(1, size))]
+        self.idle: list[EngineProcess] = list(self.engines)
+        self.changed = threading.Condition()
+
+    @property
+    def path(self) -> str:
+        return self.engines[0].path
+
+    @path.setter
+    def path(self, path: str):
+        for engine in self.engines:
+            engine.path = path
+
+    # Startup is reported for the first engine, the others launch alongside it
+    @property
+    def ready(self) -> threading.Event:
+        return self.engines[0].ready
+
+    @property
+    def ready_at(self) -> float:
+        return self.engines[0].ready_at
+
+    @property
+    def engine(self):
+        return self.engines[0].engine
+
+    @property
+    def error(self) -> Exception:
+        return self.engines[0].error
+
+    def start(self):
+        for engine in self.engines:
+            engine.start()
+
+    def acquire(self, game: object) -> EngineProcess:
+        with self.changed:
+            self.changed.wait_for(lambda: self.idle)
+
+            # Prefer the engine that searched this game last, it skips ucinewgame and keeps its hash entries
+            engine = next((engine for engine in self.idle if game is not None and engine.game == game), self.idle[0])
+            self.idle.remove(engine)
+            return engine
+
+    def release(self, engine: EngineProcess):
+        with self.changed:
+            self.idle.append(engine)
+            self.changed.notify()
+
+    def play(self, board, time_limit: float = 2.0, game: object = None):
+        # Counted from before acquire, so boards waiting for a free engine show up in the gauge
+        engine_queue_depth.inc()
+        try:
+            engine = self.acquire(game)
+            try:
+                return engine.search(board, time_limit, game)
+            finally:
+                self.release(engine)
+        finally:
+            engine_queue_depth.dec()
+
+    def quit(self):
+        for engine in self.engines:
+            engine.quit()
+
+def megabytes(value: int | None) -> str:
+    return f"{value / (1024 * 1024):.0f}" if value is not None else "?"
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    import chess
+    import chess.engine
+
+    from util.Build import find_engine
+
+    parser = argparse.ArgumentParser(description="Start engines with Hash sized from a memory budget and report what each one really uses")
+    parser.add_argument("--engine", help="engine binary, defaults to the best cached build")
+    parser.add_argument("--engines", type=int, default=2, help="engine processes sharing the budget")
+    parser.add_argument("--memory", type=int, default=512, help="MB for all engines together")
+    parser.add_argument("--threads", type=int, default=1, help="Threads per engine")
+    parser.add_argument("--depth", type=int, default=12, help="search this deep first so the hash table is touched")
+    args = parser.parse_args()
+
+    path = args.engine or find_engine()
+    if path is None:
+        sys.exit("No engine binary found, build one with python -m util.Build or pass --engine")
+
+    options = engine_options(args.memory, args.engines, args.threads)
+    engines = [EngineProcess(path, options) for _ in range(args.engines)]
+    for engine in engines:
+        engine.start()
+
+    try:
+        for engine in engines:
+            # Two games each, the second one starts with ucinewgame on the same process
+            for game in range(2):
+                engine.analyse(chess.Board(), chess.engine.Limit(depth=args.depth), game=game)
+
+        mode = transparent_huge_pages()
+        print(f"{args.engines} engines, {args.memory} MB budget: Threads {options['Threads']}, Hash {options['Hash']} MB each, transparent huge pages {mode or 'unknown'}")
+        print(f"{'pid':>8} {'hash':>6} {'rss':>6} {'peak':>6} {'huge':>6}  large pages")
+
+        total = 0
+        for engine in engines:
+            memory = engine.memory()
+            total += memory["rss"] or 0
+
+            # memory.cpp doesn't report whether madvise got huge pages, the kernel's AnonHugePages count does
+            large = "unknown" if memory["huge_pages"] is None else "yes" if memory["huge_pages"] > 0 else "no"
+            print(f"{memory['pid']:>8} {megabytes(memory['hash']):>6} {megabytes(memory['rss']):>6} {megabytes(memory['peak']):>6} {megabytes(memory['huge_pages']):>6}  {large}")
+
+        print(f"total rss {megabytes(total)} MB of {args.memory} MB")
+    finally:
+        for engine in engines:
+            engine.quit()
@@ -0,0 +1,224 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import chess
+import chess.pgn
+import numpy as np
+
+from util.Nnue import DIMENSIONS, MAX_ACTIVE, board_arrays, feature_indices
+
+
+VALUE_NONE = 32002  # Same marker the engine uses, the position has no score
+MATE_SCORE = 32000
+
+# name -> (dtype, shape of one position); every field is a flat little endian .bin file in the export folder
+FIELDS = {
+    "boards": (np.uint8, (32,)),  # 64 squares, two 4 bit engine piece codes per byte
+    "features": (np.uint16, (2, MAX_ACTIVE)),  # HalfKAv2_hm indices from white's and black's view, padded with DIMENSIONS
+    "stm": (np.uint8, ()),  # 1 white, 0 black
+    "scores": (np.int16, ()),  # centipawns from the side to move
+    "results": (np.int8, ()),  # game result from the side to move: 1 win, 0 draw, -1 loss
+    "plies": (np.uint16, ()),
+}
+
+RESULTS = {"1-0": 1, "0-1": -1, "1/2-1/2": 0}
+
+def scan_games(path: str):
+    # Only remember where each game starts, the workers parse the games themselves
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        while True:
+            offset = f.tell()
+            if not chess.pgn.skip_game(f):
+                break
+            yield offset
+
+def make_tasks(paths: list[str], games_per_task: int, min_ply: int):
+    for path in paths:
+        offsets = []
+        for offset in scan_games(path):
+            offsets.append(offset)
+            if len(offsets) == games_per_task:
+                yield path, offsets, min_ply
+                offsets = []
+        if offsets:
+            yield path, offsets, min_ply
+
+def pack_boards(pieces: np.ndarray) -> np.ndarray:
+    return (pieces[:, 0::2] | (pieces[:, 1::2] << 4)).astype(np.uint8)
+
+def unpack_boards(packed: np.ndarray) -> np.ndarray:
+    pieces = np.empty((len(packed), 64), dtype=np.int8)
+    pieces[:, 0::2] = packed & 0x0F
+    pieces[:, 1::2] = packed >> 4
+    return pieces
+
+def empty_chunk() -> dict[str, np.ndarray]:
+    return {name: np.empty((0,) + shape, dtype=dtype) for name, (dtype, shape) in FIELDS.items()}
+
+evaluator = None
+
+def init_worker(nnue: bool):
+    global evaluator
+    if nnue:
+        from util.Nnue import load_evaluator
+        evaluator = load_evaluator()
+
+def read_positions(path: str, offsets: list[int], min_ply: int):
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for offset in offsets:
+            f.seek(offset)
+            game = chess.pgn.read_game(f)
+            if game is None or game.errors:
+                continue
+
+            result = RESULTS.get(game.headers.get("Result"))
+            if result is None:
+                continue
+
+            board = game.board()
+            for node in game.mainline():
+                board.push(node.move)
+
+                # Positions in check have no static eval, the opening is mostly book moves
+                if board.ply() < min_ply or board.is_check():
+                    continue
+
+                score = node.eval()
+                score = score.pov(board.turn).score(mate_score=MATE_SCORE) if score is not None else VALUE_NONE
+                yield board.copy(stack=False), score, result if board.turn == chess.WHITE else -result
+
+def extract(task: tuple) -> dict[str, np.ndarray]:
+    path, offsets, min_ply = task
+    positions = list(read_positions(path, offsets, min_ply))
+    if not positions:
+        return empty_chunk()
+
+    boards = [board for board, _, _ in positions]
+    pieces, turns = board_arrays(boards)
+    scores = np.array([score for _, score, _ in positions], dtype=np.int32)
+
+    # Fill in positions the PGN has no [%eval] for
+    missing = scores == VALUE_NONE
+    if evaluator is not None and missing.any():
+        scores[missing] = evaluator.centipawns([board for board, skip in zip(boards, missing) if skip], white=False)
+
+    return {
+        "boards": pack_boards(pieces),
+        "features": np.stack([feature_indices(pieces, chess.WHITE), feature_indices(pieces, chess.BLACK)], axis=1).astype(np.uint16),
+        "stm": turns.astype(np.uint8),
+        "scores": np.clip(scores, -MATE_SCORE, VALUE_NONE).astype(np.int16),
+        "results": np.array([result for _, _, result in positions], dtype=np.int8),
+        "plies": np.array([board.ply() for board in boards], dtype=np.uint16),
+    }
+
+class WriteBehind:
+    def __init__(self, folder: str, size: int):
+        self.queue = queue.Queue(maxsize=size)
+        self.files = {name: open(os.path.join(folder, f"{name}.bin"), "wb") for name in FIELDS}
+        self.count = 0
+        self.error: Exception = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, chunk: dict[str, np.ndarray]):
+        # Blocks once `size` chunks are waiting, which stalls the producer instead of growing memory
+        if self.error is not None:
+            raise self.error
+        self.queue.put(chunk)
+
+    def run(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+
+            try:
+                for name, f in self.files.items():
+                    f.write(np.ascontiguousarray(chunk[name]).tobytes())
+                self.count += len(chunk["stm"])
+            except OSError as e:
+                self.error = e
+
+    def close(self) -> int:
+        self.queue.put(None)
+        self.thread.join()
+        for f in self.files.values():
+            f.close()
+
+        if self.error is not None:
+            raise self.error
+        return self.count
+
+def export(paths: list[str], folder: str, workers: int = None, games_per_task: int = 64, buffer: int = 16, min_ply: int = 8, nnue: bool = False) -> int:
+    import multiprocessing
+
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(folder, exist_ok=True)
+
+    writer = WriteBehind(folder, buffer)
+    pending = deque()
+    start = time.perf_counter()
+
+    try:
+        with multiprocessing.Pool(workers, initializer=init_worker, initargs=(nnue,)) as pool:
+            # Pool.imap would read the whole task list ahead, keep a fixed number of tasks in flight instead
+            for task in make_tasks(paths, games_per_task, min_ply):
+                pending.append(pool.apply_async(extract, (task,)))
+                if len(pending) >= 2 * workers:
+                    writer.put(pending.popleft().get())
+
+            while pending:
+                writer.put(pending.popleft().get())
+    finally:
+        count = writer.close()
+
+    meta = {
+        "count": count,
+        "fields": {name: {"dtype": np.dtype(dtype).str, "shape": list(shape)} for name, (dtype, shape) in FIELDS.items()},
+        "padding": DIMENSIONS,
+        "value_none": VALUE_NONE,
+        "min_ply": min_ply,
+        "sources": [os.path.abspath(path) for path in paths],
+        "seconds": round(time.perf_counter() - start, 1),
+    }
+    with open(os.path.join(folder, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    return count
+
+def open_dataset(folder: str) -> dict[str, np.ndarray]:
+    # Memory maps every field, nothing is read until it's indexed
+    with open(os.path.join(folder, "meta.json"), "r") as f:
+        meta = json.load(f)
+
+    dataset = {}
+    for name, field in meta["fields"].items():
+        shape = (meta["count"],) + tuple(field["shape"])
+        if meta["count"] == 0:
+            dataset[name] = np.empty(shape, dtype=field["dtype"])
+        else:
+            dataset[name] = np.memmap(os.path.join(folder, f"{name}.bin"), dtype=field["dtype"], mode="r", shape=shape)
+
+    return dataset
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export positions from PGN files into memory mapped training arrays")
+    parser.add_argument("pgn", nargs="+", help="PGN files, e.g. games/journal.pgn")
+    parser.add_argument("--output", default="export", help="folder for the .bin arrays and meta.json")
+    parser.add_argument("--workers", type=int, help="worker processes, defaults to the cpu count")
+    parser.add_argument("--games-per-task", type=int, default=64, help="games parsed per worker task")
+    parser.add_argument("--buffer", type=int, default=16, help="chunks the writer may hold before workers are throttled")
+    parser.add_argument("--min-ply", type=int, default=8, help="skip positions before this ply")
+    parser.add_argument("--nnue", action="store_true", help="score positions without a [%%eval] comment with the NNUE evaluator")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = export(args.pgn, args.output, args.workers, args.games_per_task, args.buffer, args.min_ply, args.nnue)
+    elapsed = time.perf_counter() - start
+    print(f"Exported {count} positions to {args.output} in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} positions/s)")
@@ -0,0 +1,114 @@
+import chess
+import numpy as np
+import pygame
+
+
+def attack_counts(board: chess.Board, color: chess.Color) -> np.ndarray:
+    # Number of `color` pieces attacking each square as an (8, 8) array indexed [rank, file]
+    masks = np.array([board.attacks_mask(square) for square in chess.scan_forward(board.occupied_co[color])], dtype="<u8")
+    if len(masks) == 0:
+        return np.zeros((8, 8), dtype=np.int8)
+
+    bits = np.unpackbits(masks.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    return bits.sum(axis=0, dtype=np.int8).reshape(8, 8)
+
+def mask_array(mask: int) -> np.ndarray:
+    return np.unpackbits(np.array([mask], dtype="<u8").view(np.uint8), bitorder="little").reshape(8, 8).astype(bool)
+
+class ThreatMap:
+    def __init__(self):
+        self.key: str = None
+        self.white = np.zeros((8, 8), dtype=np.int8)
+        self.black = np.zeros((8, 8), dtype=np.int8)
+        self.hanging = np.zeros((8, 8), dtype=bool)
+        self.pinned = np.zeros((8, 8), dtype=bool)
+
+    def update(self, board: chess.Board) -> bool:
+        # Attacks only depend on the piece placement, so that is the cache key
+        key = board.board_fen()
+        if key == self.key:
+            return False
+
+        self.key = key
+        self.white = attack_counts(board, chess.WHITE)
+        self.black = attack_counts(board, chess.BLACK)
+
+        white = mask_array(board.occupied_co[chess.WHITE] & ~board.kings)
+        black = mask_array(board.occupied_co[chess.BLACK] & ~board.kings)
+
+        # Attacked and not defended at all
+        self.hanging = (white & (self.black > 0) & (self.white == 0)) | (black & (self.white > 0) & (self.black == 0))
+
+        pinned = 0
+        for color in chess.COLORS:
+            for square in chess.scan_forward(board.occupied_co[color] & ~board.kings):
+                if board.is_pinned(color, square):
+                    pinned |= chess.BB_SQUARES[square]
+        self.pinned = mask_array(pinned)
+
+        return True
+
+    def control(self) -> np.ndarray:
+        # Positive where white has more attackers, negative where black does
+        return self.white.astype(np.int16) - self.black
+
+class Heatmap:
+    white_color = (70, 130, 230)
+    black_color = (220, 60, 50)
+    hanging_color = (255, 150, 0, 230)
+    pinned_color = (170, 70, 220, 230)
+
+    def __init__(self, visible: bool = False):
+        self.visible = visible
+        self.threats = ThreatMap()
+        self.surface: pygame.Surface = None
+        self.fonts: dict[int, pygame.font.Font] = {}
+
+    def toggle(self):
+        self.visible = not self.visible
+
+    def get_surface(self, board: chess.Board, square_size: int) -> pygame.Surface:
+        changed = self.threats.update(board)
+
+        if changed or self.surface is None or self.surface.get_width() != square_size * 8:
+            self.surface = self.render(square_size)
+
+        return self.surface
+
+    def render(self, square_size: int) -> pygame.Surface:
+        control = np.clip(self.threats.control(), -3, 3)
+
+        rgba = np.zeros((8, 8, 4), dtype=np.uint8)
+        rgba[..., :3] = np.where((control > 0)[..., None], self.white_color, self.black_color)
+        rgba[..., 3] = np.abs(control) * 40
+
+        # Rank 8 is the top row on screen
+        rgba = np.ascontiguousarray(rgba[::-1])
+        tint = pygame.image.frombuffer(rgba.tobytes(), (8, 8), "RGBA")
+        surface = pygame.transform.scale(tint, (square_size * 8, square_size * 8))
+
+        font_size = max(12, square_size // 4)
+        if font_size not in self.fonts:
+            self.fonts[font_size] = pygame.font.Font(None, font_size)
+        font = self.fonts[font_size]
+        border = max(2, square_size // 16)
+
+        for rank in range(8):
+            for file in range(8):
+                white, black = int(self.threats.white[rank, file]), int(self.threats.black[rank, file])
+                rect = pygame.Rect(file * square_size, (7 - rank) * square_size, square_size, square_size)
+
+                if self.threats.hanging[rank, file]:
+                    pygame.draw.rect(surface, self.hanging_color, rect, width=border)
+                if self.threats.pinned[rank, file]:
+                    pygame.draw.rect(surface, self.pinned_color, rect.inflate(-border * 2, -border * 2), width=border)
+
+                if white or black:
+                    text = font.render(f"{white}:{black}", True, (240, 240, 240))
+                    surface.blit(text, (rect.right - text.get_width() - border - 1, rect.bottom - text.get_height() - border))
+
+        # Display format, so the per-frame blit of the cached surface needs no conversion
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert_alpha()
+
+        return surface
@@ -0,0 +1,61 @@
+import math
+
+import pygame
+
+
+class Layout:
+    # Every size and offset the drawing code needs, computed once per window size
+    def __init__(self, window_size: tuple[int, int], render_scale: float = 1.0):
+        self.window_size = (max(1, window_size[0]), max(1, window_size[1]))
+        self.render_scale = min(1.0, max(0.1, render_scale))
+
+        # Everything is drawn on a canvas of this size, which is scaled up to the window when render_scale < 1
+        self.size = (max(1, int(self.window_size[0] * self.render_scale)), max(1, int(self.window_size[1] * self.render_scale)))
+        width, height = self.size
+
+        self.square_size = max(1, min(width // 10, height // 10))
+        self.board_size = self.square_size * 8
+
+        self.board_x = (width - self.board_size) // 8
+        self.board_y = (height - self.board_size) // 2
+        self.board_rect = pygame.Rect(self.board_x, self.board_y, self.board_size, self.board_size)
+
+        self.padding = (width - self.board_size) // 4
+        controls_width = width // 10 * 4 - self.padding
+        controls_height = height // 10 * 8
+        self.controls_rect = pygame.Rect(self.padding + self.board_size, (height - controls_height) // 2, controls_width, controls_height)
+
+        self.tile_cache: dict[int, list[pygame.Rect]] = {}
+
+    @property
+    def scaled(self) -> bool:
+        return self.size != self.window_size
+
+    def square_rect(self, row: int, col: int) -> pygame.Rect:
+        # Screen row, 0 is rank 8
+        return pygame.Rect(self.board_x + col * self.square_size, self.board_y + row * self.square_size, self.square_size, self.square_size)
+
+    def to_canvas(self, pos: tuple[int, int]) -> tuple[int, int]:
+        if not self.scaled:
+            return pos
+        return (pos[0] * self.size[0] // self.window_size[0], pos[1] * self.size[1] // self.window_size[1])
+
+    def tiles(self, count: int) -> list[pygame.Rect]:
+        # Simul mini-boards fill the controls panel above the side buttons (ButtonGroup: height // 12 plus padding)
+        if count not in self.tile_cache:
+            area = self.controls_rect.inflate(-20, -20)
+            area.height -= self.controls_rect.height // 12 + 10
+
+            columns = max(1, math.ceil(math.sqrt(count * area.width / max(1, area.height))))
+            rows = math.ceil(count / columns)
+
+            # Multiple of 8 so every square of a mini-board is a whole number of pixels
+            size = max(8, min(area.width // columns, area.height // max(1, rows)) - 6) // 8 * 8
+            gap = size + 6
+
+            self.tile_cache[count] = [
+                pygame.Rect(area.x + (i % columns) * gap, area.y + (i // columns) * gap, size, size)
+                for i in range(count)
+            ]
+
+        return self.tile_cache[count]
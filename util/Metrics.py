@@ -0,0 +1,218 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import json
+import os
+import threading
+import time
+
+
+def label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+def format_labels(key: tuple, extra: dict = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in items) + "}"
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: dict[tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def samples(self) -> list[tuple[str, tuple, dict, float]]:
+        with self.lock:
+            return [(self.name, key, {}, value) for key, value in self.values.items()]
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {format_labels(key) or "value": value for key, value in self.values.items()}
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels):
+        with self.lock:
+            self.values.pop(label_key(labels), None)
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: list[float]):
+        super().__init__(name, help)
+        self.buckets = sorted(buckets)
+        self.counts: dict[tuple, list[int]] = {}
+        self.sums: dict[tuple, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = label_key(labels)
+        with self.lock:
+            counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.sums[key] = self.sums.get(key, 0) + value
+
+    def samples(self) -> list[tuple[str, tuple, dict, float]]:
+        samples = []
+        with self.lock:
+            for key, counts in self.counts.items():
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", key, {"le": repr(float(bound))}, count))
+                samples.append((f"{self.name}_bucket", key, {"le": "+Inf"}, counts[-1]))
+                samples.append((f"{self.name}_sum", key, {}, self.sums[key]))
+                samples.append((f"{self.name}_count", key, {}, counts[-1]))
+        return samples
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                format_labels(key) or "value": {
+                    "buckets": dict(zip([*map(str, self.buckets), "+Inf"], counts)),
+                    "sum": self.sums[key],
+                    "count": counts[-1],
+                }
+                for key, counts in self.counts.items()
+            }
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = "chess"):
+        self.prefix = prefix
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.register(Counter(f"{self.prefix}_{name}", help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self.register(Gauge(f"{self.prefix}_{name}", help))
+
+    def histogram(self, name: str, help: str, buckets: list[float]) -> Histogram:
+        return self.register(Histogram(f"{self.prefix}_{name}", help, buckets))
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in metric.samples():
+                lines.append(f"{name}{format_labels(key, extra)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> dict:
+        return {
+            "timestamp": time.time(),
+            "metrics": {metric.name: metric.to_dict() for metric in self.metrics.values()},
+        }
+
+class MetricsExporter:
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self.server: ThreadingHTTPServer = None
+        self.thread: threading.Thread = None
+        self.stopped = threading.Event()
+
+    def start(self, mode: str, port: int = 9108, path: str = "metrics.json", interval: float = 10.0, host: str = "127.0.0.1"):
+        if mode == "prometheus":
+            self.serve(port, host)
+        elif mode == "json":
+            self.write_periodically(path, interval)
+        elif mode != "off":
+            raise ValueError(f"Unknown metrics mode {mode!r}, expected 'off', 'prometheus' or 'json'")
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = registry.render_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        # Unauthenticated, so localhost unless the host setting deliberately exposes it
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def write_periodically(self, path: str, interval: float):
+        def loop():
+            while not self.stopped.wait(interval):
+                self.write(path)
+            self.write(path)
+
+        self.thread = threading.Thread(target=loop, daemon=True)
+        self.thread.start()
+
+    def write(self, path: str):
+        # Write then rename so readers never see a half written file
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.registry.to_dict(), f, indent=2)
+        os.replace(temp_path, path)
+
+    def stop(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+
+metrics = MetricsRegistry()
+
+engine_nps = metrics.gauge("engine_nps", "Nodes per second reported with the last engine move")
+engine_depth = metrics.gauge("engine_depth", "Search depth reached for the last engine move")
+engine_seldepth = metrics.gauge("engine_seldepth", "Selective search depth reached for the last engine move")
+engine_hashfull = metrics.gauge("engine_hashfull", "Transposition table usage in permille")
+engine_queue_depth = metrics.gauge("engine_queue_depth", "Move requests waiting for an engine")
+engine_nodes = metrics.counter("engine_nodes_total", "Nodes searched by the engine")
+engine_moves = metrics.counter("engine_moves_total", "Moves returned by the engine")
+engine_restarts = metrics.counter("engine_restarts_total", "Engine processes restarted after terminating")
+engine_errors = metrics.counter("engine_errors_total", "Engine launches or searches that failed")
+engine_rss_bytes = metrics.gauge("engine_rss_bytes", "Resident memory of each engine process")
+engine_hash_bytes = metrics.gauge("engine_hash_bytes", "Hash (transposition table) size configured for each engine process")
+engine_huge_pages_bytes = metrics.gauge("engine_huge_pages_bytes", "Engine memory backed by transparent huge pages")
+engine_new_games = metrics.counter("engine_new_games_total", "New games started with ucinewgame on an already running engine")
+engine_bestmove_seconds = metrics.histogram(
+    "engine_bestmove_seconds", "Wall time from search request to bestmove",
+    [0.05, 0.1, 0.25, 0.5, 1, 2, 2.5, 5, 10]
+)
+games_started = metrics.counter("games_started_total", "Games started")
+games_finished = metrics.counter("games_finished_total", "Games finished, by result")
+games_active = metrics.gauge("games_active", "Games currently in progress")
+game_moves = metrics.counter("game_moves_total", "Moves played, by side")
+game_plies = metrics.histogram("game_plies", "Length of finished games in plies", [20, 40, 60, 80, 100, 150, 200, 300])
@@ -0,0 +1,468 @@
+import glob
+import os
+import re
+import struct
+
+import chess
+import numpy as np
+
+
+# Constants mirrored from engine/src/nnue (nnue_common.h, nnue_architecture.h, half_ka_v2_hm.h)
+VERSION = 0x7AF32F20
+LEB128_MAGIC = b"COMPRESSED_LEB128"
+OUTPUT_SCALE = 16
+WEIGHT_SCALE_BITS = 6
+PSQT_BUCKETS = 8
+LAYER_STACKS = 8
+FC_0_OUTPUTS = 15
+FC_1_OUTPUTS = 32
+PS_NB = 11 * 64
+DIMENSIONS = 64 * PS_NB // 2
+MAX_ACTIVE = 32
+FEATURE_HASH = 0x7F234CB8
+BIG_DIMENSIONS = 3072
+SMALL_DIMENSIONS = 128
+
+PIECE_VALUES = {chess.PAWN: 208, chess.KNIGHT: 781, chess.BISHOP: 825, chess.ROOK: 1276, chess.QUEEN: 2538}
+
+def mask32(value: int) -> int:
+    return value & 0xFFFFFFFF
+
+def affine_hash(outputs: int, previous: int) -> int:
+    value = mask32(0xCC03DAE4 + outputs)
+    value ^= previous >> 1
+    value ^= mask32(previous << 31)
+    return value
+
+def clipped_relu_hash(previous: int) -> int:
+    return mask32(0x538D24C7 + previous)
+
+def architecture_hash(dimensions: int) -> int:
+    value = 0xEC42E90D ^ (dimensions * 2)
+    value = affine_hash(FC_0_OUTPUTS + 1, value)
+    value = clipped_relu_hash(value)
+    value = affine_hash(FC_1_OUTPUTS, value)
+    value = clipped_relu_hash(value)
+    value = affine_hash(1, value)
+    return value
+
+def transformer_hash(dimensions: int) -> int:
+    return FEATURE_HASH ^ (dimensions * 2)
+
+def network_hash(dimensions: int) -> int:
+    return transformer_hash(dimensions) ^ architecture_hash(dimensions)
+
+def divide(a, b):
+    # C++ integer division truncates towards zero, numpy's // floors
+    return np.sign(a) * (np.abs(a) // b)
+
+def decode_leb128(data: np.ndarray, count: int, dtype, chunk_size: int = 1 << 22) -> np.ndarray:
+    out = np.empty(count, dtype=dtype)
+    position = 0
+    written = 0
+
+    while written < count:
+        chunk = data[position:position + chunk_size]
+        ends = np.flatnonzero((chunk & 0x80) == 0)[:count - written]
+        if len(ends) == 0:
+            raise ValueError("Truncated LEB128 block")
+
+        used = int(ends[-1]) + 1
+        chunk = chunk[:used].astype(np.int64)
+
+        starts = np.empty(len(ends), dtype=np.int64)
+        starts[0] = 0
+        starts[1:] = ends[:-1] + 1
+        lengths = ends - starts + 1
+
+        shifts = 7 * (np.arange(used) - np.repeat(starts, lengths))
+        values = np.add.reduceat((chunk & 0x7F) << shifts, starts)
+
+        negative = (chunk[ends] & 0x40) != 0
+        values[negative] -= np.left_shift(1, 7 * lengths[negative])
+
+        out[written:written + len(ends)] = values.astype(dtype)
+        written += len(ends)
+        position += used
+
+    return out
+
+class Reader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.view = np.frombuffer(data, dtype=np.uint8)
+        self.position = 0
+
+    def uint32(self) -> int:
+        value, = struct.unpack_from("<I", self.data, self.position)
+        self.position += 4
+        return value
+
+    def array(self, dtype, count: int) -> np.ndarray:
+        dtype = np.dtype(dtype).newbyteorder("<")
+        values = np.frombuffer(self.data, dtype=dtype, count=count, offset=self.position)
+        self.position += dtype.itemsize * count
+        return values.astype(dtype.newbyteorder("="))
+
+    def leb128(self, dtype, count: int) -> np.ndarray:
+        magic = self.data[self.position:self.position + len(LEB128_MAGIC)]
+        if magic != LEB128_MAGIC:
+            raise ValueError("Missing LEB128 magic string")
+        self.position += len(LEB128_MAGIC)
+
+        size = self.uint32()
+        values = decode_leb128(self.view[self.position:self.position + size], count, dtype)
+        self.position += size
+        return values
+
+    def expect(self, value: int, what: str):
+        found = self.uint32()
+        if found != value:
+            raise ValueError(f"Bad {what} hash {found:#010x}, expected {value:#010x}")
+
+class Network:
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            reader = Reader(f.read())
+
+        version = reader.uint32()
+        if version != VERSION:
+            raise ValueError(f"{path} has version {version:#010x}, expected {VERSION:#010x}")
+
+        file_hash = reader.uint32()
+        sizes = {network_hash(size): size for size in (BIG_DIMENSIONS, SMALL_DIMENSIONS)}
+        if file_hash not in sizes:
+            raise ValueError(f"{path} has an unknown architecture hash {file_hash:#010x}")
+
+        self.path = path
+        self.dimensions = size = sizes[file_hash]
+        description_size = reader.uint32()
+        self.description = reader.data[reader.position:reader.position + description_size].decode(errors="replace")
+        reader.position += description_size
+
+        reader.expect(transformer_hash(size), "feature transformer")
+        # The engine scales transformer weights and biases by 2 at load time and accumulates in int16,
+        # numpy's wrapping int16 arithmetic reproduces that exactly
+        self.biases = reader.leb128(np.int16, size) * np.int16(2)
+
+        # One extra zero row so padded feature slots can be gathered like any other feature
+        self.weights = np.zeros((DIMENSIONS + 1, size), dtype=np.int16)
+        self.weights[:DIMENSIONS] = reader.leb128(np.int16, DIMENSIONS * size).reshape(DIMENSIONS, size) * np.int16(2)
+        self.psqt_weights = np.zeros((DIMENSIONS + 1, PSQT_BUCKETS), dtype=np.int32)
+        self.psqt_weights[:DIMENSIONS] = reader.leb128(np.int32, DIMENSIONS * PSQT_BUCKETS).reshape(DIMENSIONS, PSQT_BUCKETS)
+
+        fc_1_inputs = 32  # FC_0_OUTPUTS * 2 padded to the SIMD width
+
+        self.fc_0_biases = np.empty((LAYER_STACKS, FC_0_OUTPUTS + 1), dtype=np.int64)
+        self.fc_0_weights = np.empty((LAYER_STACKS, FC_0_OUTPUTS + 1, size), dtype=np.float64)
+        self.fc_1_biases = np.empty((LAYER_STACKS, FC_1_OUTPUTS), dtype=np.int64)
+        self.fc_1_weights = np.empty((LAYER_STACKS, FC_1_OUTPUTS, fc_1_inputs), dtype=np.float64)
+        self.fc_2_biases = np.empty((LAYER_STACKS, 1), dtype=np.int64)
+        self.fc_2_weights = np.empty((LAYER_STACKS, 1, FC_1_OUTPUTS), dtype=np.float64)
+
+        for stack in range(LAYER_STACKS):
+            reader.expect(architecture_hash(size), "layer stack")
+            self.fc_0_biases[stack] = reader.array(np.int32, FC_0_OUTPUTS + 1)
+            self.fc_0_weights[stack] = reader.array(np.int8, (FC_0_OUTPUTS + 1) * size).reshape(FC_0_OUTPUTS + 1, size)
+            self.fc_1_biases[stack] = reader.array(np.int32, FC_1_OUTPUTS)
+            self.fc_1_weights[stack] = reader.array(np.int8, FC_1_OUTPUTS * fc_1_inputs).reshape(FC_1_OUTPUTS, fc_1_inputs)
+            self.fc_2_biases[stack] = reader.array(np.int32, 1)
+            self.fc_2_weights[stack] = reader.array(np.int8, FC_1_OUTPUTS).reshape(1, FC_1_OUTPUTS)
+
+        if reader.position != len(reader.data):
+            raise ValueError(f"{path} has {len(reader.data) - reader.position} trailing bytes")
+
+    def accumulate(self, features: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        accumulation = np.broadcast_to(self.biases, (features.shape[0], self.dimensions)).copy()
+        psqt = np.zeros((features.shape[0], PSQT_BUCKETS), dtype=np.int32)
+
+        for slot in range(features.shape[1]):
+            accumulation += self.weights[features[:, slot]]
+            psqt += self.psqt_weights[features[:, slot]]
+
+        return accumulation, psqt
+
+    def transform(self, accumulation: np.ndarray) -> np.ndarray:
+        half = self.dimensions // 2
+        first = np.clip(accumulation[:, :half], 0, 254).astype(np.int32)
+        second = np.clip(accumulation[:, half:], 0, 254).astype(np.int32)
+        return (first * second) // 512
+
+    def propagate(self, transformed: np.ndarray, buckets: np.ndarray) -> np.ndarray:
+        positional = np.empty(len(transformed), dtype=np.int64)
+
+        # Float64 matmuls are exact here (|sum| < 2^53) and far faster than integer ones
+        for stack in np.unique(buckets):
+            rows = buckets == stack
+            x = transformed[rows].astype(np.float64)
+
+            fc_0 = (x @ self.fc_0_weights[stack].T).astype(np.int64) + self.fc_0_biases[stack]
+            squared = np.minimum(127, (fc_0[:, :FC_0_OUTPUTS] * fc_0[:, :FC_0_OUTPUTS]) >> (2 * WEIGHT_SCALE_BITS + 7))
+            clipped = np.clip(fc_0[:, :FC_0_OUTPUTS] >> WEIGHT_SCALE_BITS, 0, 127)
+
+            hidden = np.zeros((len(x), self.fc_1_weights.shape[2]), dtype=np.float64)
+            hidden[:, :FC_0_OUTPUTS] = squared
+            hidden[:, FC_0_OUTPUTS:2 * FC_0_OUTPUTS] = clipped
+
+            fc_1 = (hidden @ self.fc_1_weights[stack].T).astype(np.int64) + self.fc_1_biases[stack]
+            ac_1 = np.clip(fc_1 >> WEIGHT_SCALE_BITS, 0, 127).astype(np.float64)
+            fc_2 = (ac_1 @ self.fc_2_weights[stack].T).astype(np.int64)[:, 0] + self.fc_2_biases[stack, 0]
+
+            forward = divide(fc_0[:, FC_0_OUTPUTS] * (600 * OUTPUT_SCALE), 127 * (1 << WEIGHT_SCALE_BITS))
+            positional[rows] = fc_2 + forward
+
+        return positional
+
+    def evaluate(self, batch: "Batch", chunk_size: int = 1024) -> tuple[np.ndarray, np.ndarray]:
+        # Returns (psqt, positional) in internal units from the side to move, like Network::evaluate
+        psqt = np.empty(len(batch), dtype=np.int64)
+        positional = np.empty(len(batch), dtype=np.int64)
+
+        for start in range(0, len(batch), chunk_size):
+            rows = slice(start, start + chunk_size)
+            us, us_psqt = self.accumulate(batch.features[rows, 0])
+            them, them_psqt = self.accumulate(batch.features[rows, 1])
+
+            buckets = batch.buckets[rows]
+            index = np.arange(len(buckets))
+            material = divide(us_psqt[index, buckets].astype(np.int64) - them_psqt[index, buckets], 2)
+
+            transformed = np.concatenate([self.transform(us), self.transform(them)], axis=1)
+
+            psqt[rows] = divide(material, OUTPUT_SCALE)
+            positional[rows] = divide(self.propagate(transformed, buckets), OUTPUT_SCALE)
+
+        return psqt, positional
+
+def king_buckets(perspective: chess.Color) -> np.ndarray:
+    squares = np.arange(64)
+    ranks = squares // 8 if perspective == chess.WHITE else 7 - squares // 8
+    files = squares % 8
+    return (4 * (7 - ranks) + np.where(files < 4, files, 7 - files)) * PS_NB
+
+def orientation(perspective: chess.Color) -> np.ndarray:
+    files = np.arange(64) % 8
+    if perspective == chess.WHITE:
+        return np.where(files < 4, chess.H1, chess.A1)
+    return np.where(files < 4, chess.H8, chess.A8)
+
+KING_BUCKETS = {color: king_buckets(color) for color in chess.COLORS}
+ORIENTATION = {color: orientation(color) for color in chess.COLORS}
+
+def board_arrays(boards: list[chess.Board]) -> tuple[np.ndarray, np.ndarray]:
+    # Pieces as (N, 64) codes: 0 empty, 1..6 white pawn..king, 9..14 black pawn..king (engine Piece enum)
+    pieces = np.zeros((len(boards), 64), dtype=np.int8)
+    turns = np.empty(len(boards), dtype=bool)
+
+    for i, board in enumerate(boards):
+        for square, piece in board.piece_map().items():
+            pieces[i, square] = piece.piece_type + (0 if piece.color else 8)
+        turns[i] = board.turn
+
+    return pieces, turns
+
+def feature_indices(pieces: np.ndarray, perspective: chess.Color) -> np.ndarray:
+    # HalfKAv2_hm indices of every occupied square as (N, 32), padded with DIMENSIONS
+    king_code = chess.KING + (0 if perspective else 8)
+    kings = np.argmax(pieces == king_code, axis=1)
+
+    # Widen first, the piece offsets don't fit the int8 piece codes
+    pieces = pieces.astype(np.int32)
+    types = pieces & 7
+    colors = np.where(pieces & 8, chess.BLACK, chess.WHITE)
+    squares = np.arange(64)
+
+    piece_index = np.where(
+        types == chess.KING,
+        10 * 64,
+        ((types - 1) * 2 + (colors != perspective)) * 64,
+    )
+
+    indices = (squares ^ ORIENTATION[perspective][kings][:, None]) + piece_index + KING_BUCKETS[perspective][kings][:, None]
+    indices = np.where(pieces != 0, indices, DIMENSIONS)
+
+    return np.sort(indices, axis=1)[:, :MAX_ACTIVE].astype(np.int32)
+
+class Batch:
+    def __init__(self, boards: list[chess.Board]):
+        self.pieces, self.turns = board_arrays(boards)
+
+        white = feature_indices(self.pieces, chess.WHITE)
+        black = feature_indices(self.pieces, chess.BLACK)
+
+        # Slot 0 is always the side to move, slot 1 the opponent
+        stm = self.turns[:, None]
+        self.features = np.stack([np.where(stm, white, black), np.where(stm, black, white)], axis=1)
+
+        counts = np.count_nonzero(self.pieces, axis=1)
+        self.buckets = (counts - 1) // 4
+
+        types = self.pieces & 7
+        own = np.where(self.turns[:, None], self.pieces < 8, self.pieces >= 8) & (self.pieces != 0)
+
+        self.pawns = np.count_nonzero(types == chess.PAWN, axis=1)
+        self.non_pawn_material = np.zeros(len(boards), dtype=np.int64)
+        self.simple_eval = np.zeros(len(boards), dtype=np.int64)
+
+        for piece_type, value in PIECE_VALUES.items():
+            mine = np.count_nonzero((types == piece_type) & own, axis=1)
+            theirs = np.count_nonzero((types == piece_type) & ~own & (self.pieces != 0), axis=1)
+            if piece_type != chess.PAWN:
+                self.non_pawn_material += (mine + theirs) * value
+            self.simple_eval += (mine - theirs) * value
+
+        self.material_count = sum(
+            np.count_nonzero(types == piece_type, axis=1) * weight
+            for piece_type, weight in ((chess.PAWN, 1), (chess.KNIGHT, 3), (chess.BISHOP, 3), (chess.ROOK, 5), (chess.QUEEN, 9))
+        )
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+class Evaluator:
+    def __init__(self, big: Network, small: Network = None):
+        self.big = big
+        self.small = small
+
+    def raw(self, boards: list[chess.Board]) -> np.ndarray:
+        # Big network psqt + positional from the side to move, the "NNUE evaluation" line of `eval`
+        psqt, positional = self.big.evaluate(Batch(boards))
+        return psqt + positional
+
+    def evaluate(self, boards: list[chess.Board]) -> np.ndarray:
+        return self.evaluate_batch(Batch(boards))
+
+    def evaluate_batch(self, batch: "Batch") -> np.ndarray:
+        # Eval::evaluate with zero optimism, without the grain and rule50 damping; side to move
+        small = np.abs(batch.simple_eval) > 962 if self.small is not None else np.zeros(len(batch), dtype=bool)
+
+        psqt = np.zeros(len(batch), dtype=np.int64)
+        positional = np.zeros(len(batch), dtype=np.int64)
+
+        if small.any():
+            psqt[small], positional[small] = self.small.evaluate(subset(batch, small))
+
+        # Like the engine, fall back to the big network when the small one is unsure
+        nnue = divide(125 * psqt + 131 * positional, 128)
+        small &= ~((nnue * psqt < 0) | (np.abs(nnue) < 227))
+
+        big = ~small
+        if big.any():
+            psqt[big], positional[big] = self.big.evaluate(subset(batch, big))
+
+        nnue = divide(125 * psqt + 131 * positional, 128)
+        complexity = np.abs(psqt - positional)
+        nnue -= divide(nnue * complexity, np.where(small, 18815, 17864))
+
+        material = np.where(small, 553, 532) * batch.pawns + batch.non_pawn_material
+        return divide(nnue * (73921 + material), np.where(small, 68104, 74715))
+
+    def centipawns(self, boards: list[chess.Board], white: bool = True) -> np.ndarray:
+        batch = Batch(boards)
+        return to_cp(self.evaluate_batch(batch), batch, white)
+
+def subset(batch: Batch, rows: np.ndarray) -> Batch:
+    part = Batch.__new__(Batch)
+    part.features = batch.features[rows]
+    part.buckets = batch.buckets[rows]
+    part.turns = batch.turns[rows]
+    return part
+
+def to_cp(values: np.ndarray, batch: Batch, white: bool = True) -> np.ndarray:
+    # UCIEngine::to_cp, values from the side to move; optionally flipped to white's point of view
+    m = np.clip(batch.material_count, 17, 78) / 58.0
+    a = ((-37.45051876 * m + 121.19101539) * m - 132.78783573) * m + 420.70576692
+
+    scaled = 100 * values / a
+    cp = (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)).astype(np.int64)
+
+    if white:
+        cp = np.where(batch.turns, cp, -cp)
+
+    return cp
+
+def default_network_names(source: str = "engine/src") -> dict[str, str]:
+    with open(os.path.join(source, "evaluate.h"), "r") as f:
+        text = f.read()
+    return dict(re.findall(r"#define EvalFileDefaultName(Big|Small)\s+\"(nn-[a-z0-9]+\.nnue)\"", text))
+
+def load_evaluator(folders: list[str] = None) -> Evaluator:
+    names = default_network_names()
+    folders = folders or ["engine/build/nets", "engine/src", "."]
+
+    def find(name: str) -> str | None:
+        for folder in folders:
+            matches = glob.glob(os.path.join(folder, name))
+            if matches:
+                return matches[0]
+        return None
+
+    big = find(names["Big"])
+    if big is None:
+        raise FileNotFoundError(f"Network {names['Big']} not found in {folders}, build the engine first (python -m util.Build)")
+
+    small = find(names["Small"])
+    return Evaluator(Network(big), Network(small) if small else None)
+
+def engine_evals(engine_path: str, fens: list[str]) -> list[float | None]:
+    # "NNUE evaluation" from the engine's eval command in pawns (white side), None when in check
+    import subprocess
+
+    commands = "".join(f"position fen {fen}\neval\n" for fen in fens) + "quit\n"
+    output = subprocess.run([engine_path], input=commands, capture_output=True, text=True).stdout
+
+    values = []
+    for block in output.split("Final evaluation")[:-1]:
+        match = re.search(r"NNUE evaluation\s+([+-]?\d+\.\d+)", block)
+        values.append(float(match.group(1)) if match else None)
+
+    return values
+
+VERIFY_FENS = [
+    chess.STARTING_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "r1bq1rk1/pp2bppp/2n2n2/3p4/3P4/2NB1N2/PP3PPP/R1BQ1RK1 w - - 3 10",
+    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    "4k3/8/8/8/8/8/4P3/4K3 w - - 0 1",
+    "6k1/5ppp/8/8/8/8/5PPP/3R2K1 b - - 0 1",
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+    "2r3k1/pp3ppp/4p3/3pP3/3P4/P4N2/1q3PPP/R2Q2K1 w - - 0 20",
+]
+
+def verify(engine_path: str, evaluator: Evaluator, fens: list[str] = VERIFY_FENS) -> list[tuple[str, float | None, float]]:
+    boards = [chess.Board(fen) for fen in fens]
+    batch = Batch(boards)
+    psqt, positional = evaluator.big.evaluate(batch)
+    ours = to_cp(psqt + positional, batch) / 100
+    theirs = engine_evals(engine_path, fens)
+
+    return [(fen, engine, float(mine)) for fen, engine, mine in zip(fens, theirs, ours)]
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    from util.Build import find_engine
+
+    evaluator = load_evaluator()
+    engine = sys.argv[1] if len(sys.argv) > 1 else find_engine()
+
+    mismatches = 0
+    for fen, engine_value, value in verify(engine, evaluator):
+        if engine_value is None:
+            print(f"  skip     {fen} (in check)")
+            continue
+
+        ok = abs(engine_value - value) < 0.005
+        mismatches += not ok
+        print(f"{'  ok  ' if ok else 'MISMATCH'} {engine_value:+7.2f} {value:+7.2f}  {fen}")
+
+    boards = [chess.Board(fen) for fen in VERIFY_FENS] * 400
+    start = time.perf_counter()
+    evaluator.evaluate(boards)
+    elapsed = time.perf_counter() - start
+    print(f"{len(boards)} positions in {elapsed:.2f}s ({len(boards) / elapsed:.0f} positions/s)")
+
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,62 @@
+import pygame
+
+from util.Profiler import Profiler
+
+
+class PerformanceOverlay:
+    # Frame time bucket edges in seconds: 240, 120, 60, 30 and 20 fps
+    edges = [1 / 240, 1 / 120, 1 / 60, 1 / 30, 1 / 20]
+    labels = ["<4", "4-8", "8-17", "17-33", "33-50", ">50"]
+
+    def __init__(self, profiler: Profiler, phases: list[str], counters: list[str], latencies: list[str]):
+        self.profiler = profiler
+        self.phases = phases
+        self.counters = counters
+        self.latencies = latencies
+        self.visible = False
+        self.font = pygame.font.Font(None, 18)
+        self.line_height = self.font.get_height() + 2
+
+    def toggle(self):
+        self.visible = not self.visible
+
+    def draw(self, screen: pygame.Surface):
+        lines = [f"FPS {self.profiler.fps():.0f}"]
+
+        for name in self.phases:
+            lines.append(f"{name}: {self.profiler.average(name) * 1000:.2f} ms")
+
+        for name in self.counters:
+            lines.append(f"{name}: {self.profiler.last_counters.get(name, 0)}/frame, {self.profiler.counters.get(name, 0)} total")
+
+        for name in self.latencies:
+            p50, p90, p99 = (self.profiler.percentile(name, percent) for percent in (50, 90, 99))
+            if p50 is None:
+                lines.append(f"{name}: no samples")
+            else:
+                lines.append(f"{name}: p50 {p50 * 1000:.0f} p90 {p90 * 1000:.0f} p99 {p99 * 1000:.0f} ms")
+
+        histogram_height = 60
+        width = 280
+        height = len(lines) * self.line_height + histogram_height + 30
+
+        panel = pygame.Surface((width, height), pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 180))
+
+        for i, line in enumerate(lines):
+            panel.blit(self.font.render(line, True, (230, 230, 230)), (8, 6 + i * self.line_height))
+
+        buckets = self.profiler.histogram(self.edges)
+        total = max(1, sum(buckets))
+        bar_width = (width - 16) // len(buckets)
+        base_y = height - 20
+
+        for i, count in enumerate(buckets):
+            bar_height = int(histogram_height * count / total)
+            color = (90, 200, 90) if i < 3 else (220, 180, 60) if i < 4 else (220, 80, 60)
+            pygame.draw.rect(panel, color, (8 + i * bar_width, base_y - bar_height, bar_width - 4, bar_height))
+
+            label = self.font.render(self.labels[i], True, (180, 180, 180))
+            panel.blit(label, (8 + i * bar_width, base_y + 4))
+
+        screen.blit(panel, (10, 10))
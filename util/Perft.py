@@ -0,0 +1,249 @@
+import re
+import subprocess
+import time
+
+import chess
+
+
+# Standard suite from the chess programming wiki with the known node counts per depth
+POSITIONS = [
+    ("start", chess.STARTING_FEN, [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039, 97862, 4085603]),
+    ("position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812, 43238, 674624]),
+    ("position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467, 422333]),
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8", [44, 1486, 62379, 2103487]),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", [46, 2079, 89890, 3894594]),
+]
+
+class ChessBackend:
+    name = "python-chess"
+
+    def perft(self, board: chess.Board, depth: int) -> int:
+        if depth == 1:
+            return board.legal_moves.count()
+
+        nodes = 0
+        for move in board.legal_moves:
+            board.push(move)
+            nodes += self.perft(board, depth - 1)
+            board.pop()
+        return nodes
+
+    def divide(self, fen: str, depth: int) -> dict[str, int]:
+        board = chess.Board(fen)
+        counts = {}
+        for move in board.legal_moves:
+            board.push(move)
+            counts[move.uci()] = self.perft(board, depth - 1) if depth > 1 else 1
+            board.pop()
+        return counts
+
+class ClientBackend:
+    name = "client"
+
+    def __init__(self):
+        # Client imports pygame and reads the settings, only pay for that when this backend is used
+        from Client import ChessPiece, GameColor, GamePiece
+
+        self.GamePiece = GamePiece
+        self.colors = {chess.WHITE: GameColor.WHITE, chess.BLACK: GameColor.BLACK}
+        self.pieces = {
+            chess.PAWN: ChessPiece.PAWN, chess.KNIGHT: ChessPiece.KNIGHT, chess.BISHOP: ChessPiece.BISHOP,
+            chess.ROOK: ChessPiece.ROOK, chess.QUEEN: ChessPiece.QUEEN, chess.KING: ChessPiece.KING,
+        }
+        self.pawn = ChessPiece.PAWN
+
+    def moves(self, board: chess.Board) -> list[chess.Move]:
+        # Asks GamePiece.can_move about every square, exactly like the UI highlights moves
+        color = self.colors[board.turn]
+        pieces = [
+            self.GamePiece(self.colors[piece.color], self.pieces[piece.piece_type], (chess.square_rank(square), chess.square_file(square)))
+            for square, piece in board.piece_map().items()
+        ]
+
+        game = GameView(board, color)
+        client = ClientView(color)
+
+        moves = []
+        for piece in pieces:
+            if piece.color is not color:
+                continue
+
+            from_square = chess.square(piece.location[1], piece.location[0])
+            for row, col in piece.get_possible_moves(game, client, pieces):
+                # The rules know a single promotion, the UI asks for the piece afterwards
+                promotion = chess.QUEEN if piece.piece is self.pawn and row in (0, 7) else None
+                moves.append(chess.Move(from_square, chess.square(col, row), promotion))
+
+        return moves
+
+    def perft(self, board: chess.Board, depth: int) -> int:
+        moves = self.moves(board)
+        if depth == 1:
+            return len(moves)
+
+        nodes = 0
+        for move in moves:
+            board.push(move)
+            nodes += self.perft(board, depth - 1)
+            board.pop()
+        return nodes
+
+    def divide(self, fen: str, depth: int) -> dict[str, int]:
+        board = chess.Board(fen)
+        counts = {}
+        for move in self.moves(board):
+            board.push(move)
+            counts[move.uci()] = self.perft(board, depth - 1) if depth > 1 else 1
+            board.pop()
+        return counts
+
+class GameView:
+    # The parts of Game that GamePiece.can_move reads
+    def __init__(self, board: chess.Board, next_move):
+        self.board = board
+        self.next_move = next_move
+
+class ClientView:
+    def __init__(self, color):
+        self.color = color
+
+class EngineBackend:
+    name = "engine"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.process = subprocess.Popen([path], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        # Wait for the network to load so it isn't counted in the first timing
+        self.send("isready")
+        self.read_until("readyok")
+
+    def send(self, command: str):
+        self.process.stdin.write(command + "\n")
+        self.process.stdin.flush()
+
+    def read_until(self, prefix: str) -> list[str]:
+        lines = []
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise RuntimeError(f"Engine {self.path} exited unexpectedly")
+
+            line = line.strip()
+            lines.append(line)
+            if line.startswith(prefix):
+                return lines
+
+    def run(self, fen: str, depth: int) -> tuple[int, dict[str, int]]:
+        self.send(f"position fen {fen}")
+        self.send(f"go perft {depth}")
+        lines = self.read_until("Nodes searched")
+
+        counts = {}
+        for line in lines:
+            match = re.fullmatch(r"(\w+): (\d+)", line)
+            if match:
+                counts[match.group(1)] = int(match.group(2))
+
+        return int(lines[-1].split(":")[1]), counts
+
+    def perft(self, board: chess.Board, depth: int) -> int:
+        return self.run(board.fen(), depth)[0]
+
+    def divide(self, fen: str, depth: int) -> dict[str, int]:
+        return self.run(fen, depth)[1]
+
+    def quit(self):
+        self.send("quit")
+        self.process.wait()
+
+def run(backend, depths: list[int], positions: list = POSITIONS) -> list[dict]:
+    results = []
+    for name, fen, expected in positions:
+        for depth in depths:
+            if depth > len(expected):
+                continue
+
+            board = chess.Board(fen)
+            start = time.perf_counter()
+            nodes = backend.perft(board, depth)
+            elapsed = time.perf_counter() - start
+
+            results.append({
+                "backend": backend.name,
+                "position": name,
+                "fen": fen,
+                "depth": depth,
+                "nodes": nodes,
+                "expected": expected[depth - 1],
+                "ok": nodes == expected[depth - 1],
+                "seconds": elapsed,
+                "nps": nodes / elapsed if elapsed > 0 else 0,
+            })
+    return results
+
+def compare_divide(backend, fen: str, depth: int) -> list[str]:
+    # Per root move differences against python-chess, the usual first step in finding a movegen bug
+    theirs = ChessBackend().divide(fen, depth)
+    ours = backend.divide(fen, depth)
+
+    lines = []
+    for move in sorted(set(theirs) | set(ours)):
+        if move not in ours:
+            lines.append(f"{move}: missing (expected {theirs[move]})")
+        elif move not in theirs:
+            lines.append(f"{move}: illegal ({ours[move]} nodes)")
+        elif ours[move] != theirs[move]:
+            lines.append(f"{move}: {ours[move]} nodes, expected {theirs[move]}")
+    return lines
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Check move generation node counts and speed against the standard perft suite")
+    parser.add_argument("--backends", nargs="+", choices=["client", "chess", "engine"], default=["client", "chess", "engine"])
+    parser.add_argument("--depth", type=int, default=3, help="maximum depth for python-chess and the engine")
+    parser.add_argument("--client-depth", type=int, default=2, help="maximum depth for the client rules, which are far slower")
+    parser.add_argument("--engine", help="engine binary, defaults to the best cached build")
+    parser.add_argument("--divide", action="store_true", help="print per move differences for every mismatch")
+    args = parser.parse_args()
+
+    backends = []
+    for choice in args.backends:
+        if choice == "client":
+            backends.append((ClientBackend(), args.client_depth))
+        elif choice == "chess":
+            backends.append((ChessBackend(), args.depth))
+        else:
+            from util.Build import find_engine
+
+            path = args.engine or find_engine()
+            if path is None:
+                print("No engine binary found, build one with python -m util.Build or pass --engine")
+                continue
+            backends.append((EngineBackend(path), args.depth))
+
+    mismatches = 0
+    print(f"{'backend':<13} {'position':<11} {'depth':>5} {'nodes':>10} {'expected':>10} {'nps':>12}")
+    for backend, depth in backends:
+        total_nodes = 0
+        total_time = 0.0
+
+        for result in run(backend, list(range(1, depth + 1))):
+            status = "" if result["ok"] else "  MISMATCH"
+            mismatches += not result["ok"]
+            total_nodes += result["nodes"]
+            total_time += result["seconds"]
+            print(f"{result['backend']:<13} {result['position']:<11} {result['depth']:>5} {result['nodes']:>10} {result['expected']:>10} {result['nps']:>12.0f}{status}")
+
+            if args.divide and not result["ok"] and result["depth"] <= 2:
+                for line in compare_divide(backend, result["fen"], result["depth"]):
+                    print(f"    {line}")
+
+        print(f"{backend.name:<13} total {total_nodes} nodes in {total_time:.2f}s ({total_nodes / max(total_time, 1e-9):.0f} nps)\n")
+
+        if isinstance(backend, EngineBackend):
+            backend.quit()
+
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,109 @@
+from collections import deque
+from contextlib import contextmanager
+
+import os
+import time
+
+
+class Profiler:
+    def __init__(self, history: int = 240):
+        self.history = history
+        self.frames = 0
+        self.frame_start: float = None
+        self.frame_times: deque[float] = deque(maxlen=history)
+        self.phases: dict[str, deque[float]] = {}
+        self.current: dict[str, float] = {}
+        self.counters: dict[str, int] = {}
+        self.frame_counters: dict[str, int] = {}
+        self.last_counters: dict[str, int] = {}
+        self.latencies: dict[str, deque[float]] = {}
+
+        self.dump_every = 0
+        self.dump_folder = "profiles"
+        self.profile = None
+        self.profile_start = 0
+
+    def begin_frame(self):
+        now = time.perf_counter()
+
+        if self.frame_start is not None:
+            self.frame_times.append(now - self.frame_start)
+
+        self.frame_start = now
+
+        if self.dump_every > 0 and self.profile is None:
+            import cProfile
+
+            self.profile = cProfile.Profile()
+            self.profile_start = self.frames
+            self.profile.enable()
+
+    def end_frame(self):
+        for name, elapsed in self.current.items():
+            self.phases.setdefault(name, deque(maxlen=self.history)).append(elapsed)
+        self.current = {}
+
+        self.last_counters = self.frame_counters
+        self.frame_counters = {}
+        self.frames += 1
+
+        if self.profile is not None and self.frames - self.profile_start >= self.dump_every:
+            self.dump()
+
+    def dump(self):
+        self.profile.disable()
+
+        os.makedirs(self.dump_folder, exist_ok=True)
+        path = os.path.join(self.dump_folder, f"frames-{self.profile_start}-{self.frames}.prof")
+        self.profile.dump_stats(path)
+
+        self.profile = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.current[name] = self.current.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+        self.frame_counters[name] = self.frame_counters.get(name, 0) + amount
+
+    def record(self, name: str, seconds: float):
+        # Safe to call from worker threads, deque.append is atomic
+        if name not in self.latencies:
+            self.latencies[name] = deque(maxlen=self.history)
+        self.latencies[name].append(seconds)
+
+    def fps(self) -> float:
+        if not self.frame_times:
+            return 0.0
+        return len(self.frame_times) / sum(self.frame_times)
+
+    def average(self, name: str) -> float:
+        samples = self.phases.get(name)
+        if not samples:
+            return 0.0
+        return sum(samples) / len(samples)
+
+    def percentile(self, name: str, percent: float) -> float | None:
+        samples = self.latencies.get(name)
+        if not samples:
+            return None
+
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def histogram(self, edges: list[float]) -> list[int]:
+        buckets = [0] * (len(edges) + 1)
+        for frame_time in self.frame_times:
+            index = 0
+            while index < len(edges) and frame_time >= edges[index]:
+                index += 1
+            buckets[index] += 1
+        return buckets
+
+profiler = Profiler()
@@ -0,0 +1,309 @@
+import json
+import os
+import time
+from collections import deque
+
+import chess
+import chess.engine
+import chess.pgn
+import chess.polyglot
+
+from util.Export import make_tasks
+
+
+MATE_VALUE = 10000
+PIECE_VALUES = {chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9, chess.KING: 0}
+
+class Thresholds:
+    def __init__(self, shallow_depth: int = 8, deep_depth: int = 18, swing: int = 200, winning: int = 200, unique_gap: int = 200, max_moves: int = 3, use_cached: bool = True):
+        self.shallow_depth = shallow_depth
+        self.deep_depth = deep_depth
+        self.swing = swing  # how much the blunder has to hand the solver, centipawns
+        self.winning = winning  # the solver's eval after the best move
+        self.unique_gap = unique_gap  # how much worse the second best move has to be
+        self.max_moves = max_moves  # solver moves in the longest solution
+        self.use_cached = use_cached  # trust [%eval] comments instead of the shallow search
+
+def value(score: chess.engine.PovScore, color: chess.Color) -> int:
+    return score.pov(color).score(mate_score=MATE_VALUE)
+
+engine = None
+thresholds: Thresholds = None
+
+def init_worker(engine_path: str, options: dict, limits: Thresholds):
+    global engine, thresholds
+    from util.Engine import EngineProcess
+
+    # One engine per worker process, kept for every task it runs
+    engine = EngineProcess(engine_path, options)
+    thresholds = limits
+
+def shallow_scores(game: chess.pgn.Game) -> tuple[list[chess.engine.PovScore], list[chess.Move]]:
+    nodes = list(game.mainline())
+    scores = [node.eval() for node in nodes]
+
+    # Games exported by util.Analysis already carry an eval for every move
+    if thresholds.use_cached and nodes and all(score is not None for score in scores):
+        return [chess.engine.PovScore(chess.engine.Cp(0), chess.WHITE)] + scores, [None] * (len(nodes) + 1)
+
+    board = game.board()
+    scores, best = [], []
+    for move in [None] + [node.move for node in nodes]:
+        if move is not None:
+            board.push(move)
+
+        if board.is_game_over():
+            scores.append(None)
+            best.append(None)
+            continue
+
+        info = engine.analyse(board, chess.engine.Limit(depth=thresholds.shallow_depth), game=game)[0]
+        scores.append(info["score"])
+        best.append(info["pv"][0] if info.get("pv") else None)
+
+    return scores, best
+
+def candidates(game: chess.pgn.Game, min_ply: int):
+    scores, shallow_best = shallow_scores(game)
+    board = game.board()
+
+    for ply, node in enumerate(game.mainline(), start=1):
+        board.push(node.move)
+        before, after = scores[ply - 1], scores[ply]
+        if ply < min_ply or before is None or after is None or board.legal_moves.count() < 2:
+            continue
+
+        solver = board.turn
+        gained = value(after, solver) - value(before, solver)
+
+        # The opponent's last move threw away at least `swing`, and the solver wasn't already winning easily
+        if gained >= thresholds.swing and value(after, solver) >= thresholds.winning and value(before, solver) < 3 * thresholds.winning:
+            yield ply, board.copy(stack=False), node.move, shallow_best[ply]
+
+def unique_line(board: chess.Board, game: chess.pgn.Game) -> tuple[bool, dict]:
+    infos = engine.analyse(board, chess.engine.Limit(depth=thresholds.deep_depth), multipv=2, game=game)
+    best = infos[0]
+    best_value = value(best["score"], board.turn)
+
+    if not best.get("pv") or best_value < thresholds.winning:
+        return False, best
+    if len(infos) < 2:
+        return True, best
+
+    second = infos[1]["score"].pov(board.turn)
+    if best["score"].pov(board.turn).is_mate():
+        # Any mate is a solution, a second mate makes it ambiguous
+        return not (second.is_mate() and second.mate() > 0), best
+
+    second_value = second.score(mate_score=MATE_VALUE)
+    return best_value - second_value >= thresholds.unique_gap and second_value < thresholds.winning, best
+
+def verify(board: chess.Board, game: chess.pgn.Game) -> dict | None:
+    unique, best = unique_line(board, game)
+    if not unique:
+        return None
+
+    solution = [best["pv"][0]]
+    pv = best["pv"]
+    position = board.copy(stack=False)
+    position.push(pv[0])
+
+    # Extend with the expected reply and the next solver move while that move is the only one that works
+    while len(solution) < 2 * thresholds.max_moves - 1 and len(pv) >= len(solution) + 2 and not position.is_game_over():
+        reply = pv[len(solution)]
+        position.push(reply)
+
+        unique, info = unique_line(position, game)
+        if not unique:
+            break
+
+        solution += [reply, info["pv"][0]]
+        pv = solution + info["pv"][1:]
+        position.push(info["pv"][0])
+
+    return {"solution": solution, "score": best["score"].pov(board.turn), "depth": best.get("depth")}
+
+def themes(board: chess.Board, solution: list[chess.Move], score: chess.engine.Score) -> list[str]:
+    found = []
+    if score.is_mate():
+        found.append(f"mateIn{(len(solution) + 1) // 2}" if score.mate() == (len(solution) + 1) // 2 else "mate")
+
+    first = solution[0]
+    if board.is_capture(first):
+        found.append("capture")
+    if board.gives_check(first):
+        found.append("check")
+    if not board.is_capture(first) and not board.gives_check(first):
+        found.append("quietMove")
+
+    # Moving a piece onto a square the opponent attacks for less than it's worth
+    moved = board.piece_type_at(first.from_square)
+    captured = board.piece_type_at(first.to_square) or 0
+    if board.is_attacked_by(not board.turn, first.to_square) and PIECE_VALUES[moved] - PIECE_VALUES.get(captured, 0) >= 2:
+        found.append("sacrifice")
+
+    found.append("short" if len(solution) == 1 else "long" if len(solution) >= 5 else "medium")
+    return found
+
+def rate(solution: list[chess.Move], found: list[str], shallow_missed: bool) -> int:
+    # A heuristic until enough attempts exist for a Glicko rating: longer, quieter and deeper is harder
+    rating = 900 + 250 * (len(solution) // 2)
+    rating += 350 if shallow_missed else 0
+    rating += 200 if "quietMove" in found else 0
+    rating += 150 if "sacrifice" in found else 0
+    rating -= 100 if "mate" in found or any(theme.startswith("mateIn") for theme in found) else 0
+    return max(600, min(2800, rating))
+
+def mine(task: tuple) -> tuple[str, list[dict]]:
+    path, offsets, min_ply = task
+    puzzles = []
+    seen = set()
+
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for offset in offsets:
+            f.seek(offset)
+            game = chess.pgn.read_game(f)
+            if game is None or game.errors:
+                continue
+
+            for ply, board, last_move, shallow_best in candidates(game, min_ply):
+                key = chess.polyglot.zobrist_hash(board)
+                if key in seen:
+                    continue
+                seen.add(key)
+
+                # Only the candidates pay for the deep multi-PV search
+                verified = verify(board, game)
+                if verified is None:
+                    continue
+
+                solution = verified["solution"]
+                found = themes(board, solution, verified["score"])
+                puzzles.append({
+                    "id": f"{key:016x}",
+                    "fen": board.fen(),
+                    "last_move": last_move.uci(),
+                    "solution": [move.uci() for move in solution],
+                    "rating": rate(solution, found, shallow_best is not None and shallow_best != solution[0]),
+                    "themes": found,
+                    "eval": verified["score"].score(mate_score=MATE_VALUE) if not verified["score"].is_mate() else f"#{verified['score'].mate()}",
+                    "depth": verified["depth"],
+                    "source": {"path": os.path.abspath(path), "offset": offset, "ply": ply, "white": game.headers.get("White"), "black": game.headers.get("Black")},
+                })
+
+    return f"{os.path.abspath(path)}:{offsets[0]}", puzzles
+
+class Checkpoint:
+    # Finished task keys next to the output, so a restart skips the work that is already in the output file
+    def __init__(self, path: str):
+        self.path = path
+        self.tasks: set[str] = set()
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.tasks = set(json.load(f)["tasks"])
+
+    def save(self):
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"tasks": sorted(self.tasks), "saved_at": time.time()}, f)
+        os.replace(temporary, self.path)
+
+def load_seen(path: str) -> set[int]:
+    seen = set()
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    seen.add(int(json.loads(line)["id"], 16))
+    return seen
+
+def run(paths: list[str], output: str, engine_path: str, limits: Thresholds, workers: int = None, games_per_task: int = 16, min_ply: int = 10, hash_mb: int = 16, resume: bool = True, checkpoint_every: int = 1) -> dict:
+    import multiprocessing
+
+    workers = workers or os.cpu_count() or 1
+    checkpoint = Checkpoint(f"{output}.checkpoint")
+
+    if not resume:
+        checkpoint.tasks.clear()
+        if os.path.exists(output):
+            os.remove(output)
+
+    # Zobrist keys of every puzzle already written, the same position reached in two games is kept once
+    seen = load_seen(output)
+    stats = {"tasks": 0, "skipped": 0, "found": 0, "duplicates": 0, "written": 0}
+    pending = deque()
+    start = time.perf_counter()
+
+    def collect(result):
+        key, puzzles = result
+        for puzzle in puzzles:
+            stats["found"] += 1
+            if int(puzzle["id"], 16) in seen:
+                stats["duplicates"] += 1
+                continue
+
+            seen.add(int(puzzle["id"], 16))
+            f.write(json.dumps(puzzle) + "\n")
+            stats["written"] += 1
+
+        # Output first, then the checkpoint; a crash in between only repeats a task whose puzzles are deduplicated
+        f.flush()
+        checkpoint.tasks.add(key)
+        stats["tasks"] += 1
+        if stats["tasks"] % checkpoint_every == 0:
+            checkpoint.save()
+
+    options = {"Threads": 1, "Hash": hash_mb}
+    with open(output, "a") as f, multiprocessing.Pool(workers, initializer=init_worker, initargs=(engine_path, options, limits)) as pool:
+        for task in make_tasks(paths, games_per_task, min_ply):
+            if f"{os.path.abspath(task[0])}:{task[1][0]}" in checkpoint.tasks:
+                stats["skipped"] += 1
+                continue
+
+            pending.append(pool.apply_async(mine, (task,)))
+            if len(pending) >= 2 * workers:
+                collect(pending.popleft().get())
+
+        while pending:
+            collect(pending.popleft().get())
+
+    checkpoint.save()
+    stats["seconds"] = round(time.perf_counter() - start, 1)
+    return stats
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Mine puzzles from PGN archives: a shallow pass finds blunders, a deep multi-PV search keeps the ones with a unique solution")
+    parser.add_argument("pgn", nargs="+", help="PGN files, e.g. games/journal.pgn or the output of util.Analysis")
+    parser.add_argument("--output", default="puzzles.jsonl", help="one puzzle per line, a .checkpoint file is kept next to it")
+    parser.add_argument("--engine", help="engine binary, defaults to the best cached build")
+    parser.add_argument("--workers", type=int, help="worker processes, each with its own engine, defaults to the cpu count")
+    parser.add_argument("--hash", type=int, default=16, help="Hash per engine in MB")
+    parser.add_argument("--memory", type=int, help="MB for all engines together, sets --hash for every worker from this budget")
+    parser.add_argument("--games-per-task", type=int, default=16)
+    parser.add_argument("--min-ply", type=int, default=10, help="skip puzzles before this ply, openings are mostly theory")
+    parser.add_argument("--shallow-depth", type=int, default=8)
+    parser.add_argument("--deep-depth", type=int, default=18)
+    parser.add_argument("--swing", type=int, default=200, help="centipawns the blunder has to give away")
+    parser.add_argument("--max-moves", type=int, default=3, help="solver moves in the longest solution")
+    parser.add_argument("--no-cached", action="store_true", help="always run the shallow search, even when the PGN has [%%eval] comments")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start a new output file")
+    args = parser.parse_args()
+
+    from util.Build import find_engine
+
+    engine_path = args.engine or find_engine()
+    if engine_path is None:
+        sys.exit("No engine binary found, build one with python -m util.Build or pass --engine")
+
+    if args.memory:
+        from util.Engine import hash_per_engine
+        args.hash = hash_per_engine(args.memory, args.workers or os.cpu_count() or 1)
+
+    limits = Thresholds(args.shallow_depth, args.deep_depth, args.swing, args.swing, max_moves=args.max_moves, use_cached=not args.no_cached)
+    stats = run(args.pgn, args.output, engine_path, limits, args.workers, args.games_per_task, args.min_ply, args.hash, resume=not args.restart)
+
+    print(f"{stats['written']} new puzzles in {args.output} ({stats['found']} verified, {stats['duplicates']} duplicates, "
+          f"{stats['tasks']} tasks, {stats['skipped']} skipped from the checkpoint) in {stats['seconds']}s")
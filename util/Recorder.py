@@ -0,0 +1,91 @@
+import gzip
+import json
+import os
+import time
+
+import pygame
+
+
+VERSION = 1
+
+# Only the events Client.handle_event reacts to, with the attributes it reads
+EVENTS = {
+    "QUIT": (pygame.QUIT, ()),
+    "KEYDOWN": (pygame.KEYDOWN, ("key",)),
+    "MOUSEBUTTONDOWN": (pygame.MOUSEBUTTONDOWN, ("pos", "button")),
+    "MOUSEBUTTONUP": (pygame.MOUSEBUTTONUP, ("pos", "button")),
+    "MOUSEMOTION": (pygame.MOUSEMOTION, ("pos",)),
+    "VIDEORESIZE": (pygame.VIDEORESIZE, ("size",)),
+}
+
+EVENT_NAMES = {event_type: name for name, (event_type, _) in EVENTS.items()}
+
+def encode_event(event: pygame.event.Event) -> list | None:
+    name = EVENT_NAMES.get(event.type)
+    if name is None:
+        return None
+
+    return [name] + [getattr(event, attribute) for attribute in EVENTS[name][1]]
+
+def decode_event(data: list) -> pygame.event.Event:
+    event_type, attributes = EVENTS[data[0]]
+    values = {attribute: tuple(value) if isinstance(value, list) else value for attribute, value in zip(attributes, data[1:])}
+
+    if data[0] == "VIDEORESIZE":
+        values["w"], values["h"] = values["size"]
+
+    return pygame.event.Event(event_type, values)
+
+class Recorder:
+    # One gzipped JSON line per frame: [milliseconds since the last frame, events, engine replies, mouse position]
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.last: float = None
+        self.frames = 0
+
+    def start(self, header: dict):
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self.file = gzip.open(self.path, "wt", encoding="utf-8")
+        self.write(dict(header, version=VERSION, recorded_at=time.time()))
+        self.last = time.perf_counter()
+
+    def write(self, data):
+        self.file.write(json.dumps(data, separators=(",", ":")) + "\n")
+
+    def capture(self, events: list[pygame.event.Event]) -> tuple[list, list]:
+        return [data for data in map(encode_event, events) if data is not None], list(pygame.mouse.get_pos())
+
+    def record(self, captured: tuple[list, list], replies: list[str]):
+        now = time.perf_counter()
+        elapsed = round((now - self.last) * 1000, 2)
+        self.last = now
+
+        events, mouse = captured
+        self.write([elapsed, events, replies, mouse])
+        self.frames += 1
+
+    def stop(self, moves: list[str]):
+        if self.file is None:
+            return
+
+        # The footer lets a replay check that it reached the same game
+        self.write({"frames": self.frames, "moves": moves})
+        self.file.close()
+        self.file = None
+
+def read_recording(path: str) -> tuple[dict, list[list], dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+
+    if not lines or lines[0].get("version") != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} recording")
+
+    header = lines[0]
+    footer = lines[-1] if len(lines) > 1 and isinstance(lines[-1], dict) else {}
+    frames = lines[1:-1] if footer else lines[1:]
+
+    return header, frames, footer
@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import deque
+
+import chess
+import pygame
+
+from Client import AIGameClient, Client, Game, GameClient, GameState
+from util.Profiler import profiler
+from util.Recorder import decode_event, read_recording
+
+
+PHASES = ["events", "draw_board", "draw_controls", "display.update"]
+
+class ReplayDiverged(Exception):
+    pass
+
+class RecordedEngine:
+    # Stands in for EngineProcess and answers with the replies from the recording
+    def __init__(self):
+        self.path: str = None
+        self.engine = None
+        self.error: Exception = None
+        self.answers: deque[chess.Move] = deque()
+        self.ready = threading.Event()
+        self.ready.set()
+        self.ready_at = time.perf_counter()
+
+    def start(self):
+        pass
+
+    def play(self, board: chess.Board, time_limit: float = 2.0, game: object = None) -> chess.Move:
+        move = self.answers.popleft()
+        if move not in board.legal_moves:
+            raise ReplayDiverged(f"Recorded reply {move.uci()} is illegal in {board.fen()}")
+        return move
+
+    def quit(self):
+        pass
+
+class ReplayGame(Game):
+    def __init__(self, one: GameClient, two: GameClient):
+        self.requests = deque()
+        super().__init__(one, two)
+
+    def run_ai_move_async(self, client, piece, old, new):
+        # Searched in drain_replies at the frame the recording got the reply, never on a thread
+        self.requests.append((client, piece, old, new))
+
+    def drain_replies(self) -> list[chess.Move]:
+        engine = self.ai_client.engine
+
+        # handle_ai_move ignores requests where the engine isn't to move, their answer stays queued for the next one
+        while engine.answers and self.requests:
+            self.handle_ai_move(*self.requests.popleft())
+
+        return super().drain_replies()
+
+    def save(self, path: str):
+        # The journal is training data for util.Export, replaying a recording must not add the same game again
+        pass
+
+class ReplayClient(Client):
+    def __init__(self, header: dict):
+        self.pointer = (0, 0)
+        super().__init__(engine=RecordedEngine())
+
+        # Same window, canvas and toggles as when the recording started
+        pygame.display.set_mode(header["window"], pygame.DOUBLEBUF | pygame.RESIZABLE)
+        self.render_scale = header["render_scale"]
+        self.set_layout()
+
+        self.overlay.visible = header["overlay"]
+        self.heatmap.visible = header["heatmap"]
+
+    def mouse_pos(self) -> tuple[int, int]:
+        return self.layout.to_canvas(self.pointer)
+
+    def handle_event(self, event: pygame.event.Event):
+        if event.type == pygame.VIDEORESIZE:
+            # Only a real window manager resizes the display surface before the event arrives
+            pygame.display.set_mode(event.size, pygame.DOUBLEBUF | pygame.RESIZABLE)
+
+        super().handle_event(event)
+
+def percentile(ordered: list[float], percent: float) -> float:
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+def replay(path: str, realtime: bool = False) -> dict:
+    header, frames, footer = read_recording(path)
+
+    client = ReplayClient(header)
+    engine = client.engine
+    client.start_game(ReplayGame(GameClient("User"), AIGameClient(engine)))
+
+    timings = []
+    for elapsed, events, replies, mouse in frames:
+        if client.state != GameState.STARTED:
+            break
+
+        engine.answers.extend(chess.Move.from_uci(uci) for uci in replies)
+        client.pointer = tuple(mouse)
+
+        start = time.perf_counter()
+        client.frame([decode_event(data) for data in events])
+        took = time.perf_counter() - start
+
+        timing = {"frame": took, "recorded": elapsed / 1000, "inputs": len(events)}
+        timing.update({name: profiler.phases[name][-1] for name in PHASES if name in profiler.phases})
+        timings.append(timing)
+
+        if realtime:
+            time.sleep(max(0.0, elapsed / 1000 - took))
+
+    moves = list(client.game.moves)
+    client.quit()
+
+    if engine.answers:
+        raise ReplayDiverged(f"{len(engine.answers)} recorded replies were never asked for")
+    if "moves" in footer and moves != footer["moves"]:
+        raise ReplayDiverged(f"Replay ended with {' '.join(moves)}, the recording with {' '.join(footer['moves'])}")
+
+    return {"path": path, "moves": moves, "timings": timings}
+
+def summarize(timings: list[dict]) -> dict:
+    summary = {}
+    for name in ["frame"] + PHASES:
+        ordered = sorted(timing[name] for timing in timings if name in timing)
+        if not ordered:
+            continue
+
+        summary[name] = {
+            "mean": sum(ordered) / len(ordered),
+            "p50": percentile(ordered, 50),
+            "p90": percentile(ordered, 90),
+            "p99": percentile(ordered, 99),
+            "max": ordered[-1],
+        }
+    return summary
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import os
+    import sys
+
+    parser = argparse.ArgumentParser(description="Replay a recording made with Client.py --record and report per frame timings")
+    parser.add_argument("recording", help="recording file, e.g. recordings/20240101-120000.jsonl.gz")
+    parser.add_argument("--window", action="store_true", help="open a real window instead of running headless")
+    parser.add_argument("--realtime", action="store_true", help="wait out the recorded frame times instead of replaying as fast as possible")
+    parser.add_argument("--repeat", type=int, default=1, help="replay this many times, the timings of every run are reported")
+    parser.add_argument("--slowest", type=int, default=5, help="list this many of the slowest frames")
+    parser.add_argument("--json", help="write every frame's timings to this file")
+    args = parser.parse_args()
+
+    if not args.window:
+        os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+    runs = []
+    for run in range(args.repeat):
+        try:
+            result = replay(args.recording, args.realtime)
+        except ReplayDiverged as e:
+            print(f"Replay diverged: {e}")
+            sys.exit(1)
+
+        runs.append(result)
+        timings = result["timings"]
+        print(f"run {run + 1}: {len(timings)} frames, {len(result['moves'])} moves, {sum(t['frame'] for t in timings):.2f}s")
+
+        for name, stats in summarize(timings).items():
+            print(f"  {name:<15} " + " ".join(f"{key} {value * 1000:7.2f}" for key, value in stats.items()) + " ms")
+
+        slowest = sorted(range(len(timings)), key=lambda i: timings[i]["frame"], reverse=True)[:args.slowest]
+        for i in slowest:
+            print(f"  frame {i:>6}: {timings[i]['frame'] * 1000:7.2f} ms ({timings[i]['inputs']} input events)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"recording": args.recording, "runs": [{"moves": r["moves"], "timings": r["timings"], "summary": summarize(r["timings"])} for r in runs]}, f)
@@ -0,0 +1,59 @@
+import pygame
+
+
+class MiniBoard:
+    light_color = "#ba9f7a"
+    dark_color = "#6f5038"
+    last_color = "#c7a355"
+    prev_color = "#a07b32"
+    active_color = "#e0e0e0"
+    waiting_color = "#6d8cb0"
+    finished_color = "#555555"
+
+    def __init__(self, get_sprite):
+        # get_sprite(color, piece, size) is GamePiece.get_sprite, passed in so this module doesn't import Client
+        self.get_sprite = get_sprite
+        self.key: tuple = None
+        self.surface: pygame.Surface = None
+        self.renders = 0
+
+    def get_surface(self, game, size: int, active: bool, to_move: bool) -> pygame.Surface:
+        # Positions only change through moves, so the move count stands in for the position
+        key = (len(game.moves), size, active, to_move, game.finished)
+        if key != self.key:
+            self.key = key
+            self.surface = self.render(game, size, active, to_move)
+            self.renders += 1
+
+        return self.surface
+
+    def render(self, game, size: int, active: bool, to_move: bool) -> pygame.Surface:
+        square_size = size // 8
+        surface = pygame.Surface((size, size)).convert()
+
+        for row in range(8):
+            for col in range(8):
+                reversed_row = 7 - row
+                color = self.light_color if (reversed_row + col) % 2 == 0 else self.dark_color
+
+                if game.prev == (reversed_row, col):
+                    color = self.prev_color
+                if game.last == (reversed_row, col):
+                    color = self.last_color
+
+                surface.fill(color, (col * square_size, row * square_size, square_size, square_size))
+
+        for piece in game.one.pieces + game.two.pieces:
+            row, col = piece.location
+            surface.blit(self.get_sprite(piece.color, piece.piece, square_size), (col * square_size, (7 - row) * square_size))
+
+        if game.finished:
+            shade = pygame.Surface((size, size), pygame.SRCALPHA)
+            shade.fill((0, 0, 0, 120))
+            surface.blit(shade, (0, 0))
+
+        border = self.active_color if active else self.waiting_color if to_move else self.finished_color if game.finished else None
+        if border is not None:
+            pygame.draw.rect(surface, border, surface.get_rect(), width=max(2, size // 40))
+
+        return surface
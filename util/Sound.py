@@ -0,0 +1,70 @@
+from enum import Enum
+
+import os
+import threading
+import time
+
+import pygame
+
+
+class SoundKey(Enum):
+    MOVE = "move-self.mp3"
+    CAPTURE = "move-capture.mp3"
+    CHECK = "move-check.mp3"
+    CASTLE = "castle.mp3"
+    PROMOTE = "promote.mp3"
+
+class SoundManager:
+    def __init__(self, folder: str = "assets/audio", channels: int = 4):
+        self.folder = folder
+        self.channel_count = channels
+        self.sounds: dict[SoundKey, pygame.mixer.Sound] = {}
+        self.channels: list[pygame.mixer.Channel] = []
+        self.next_channel = 0
+        self.loaded = threading.Event()
+        self.loaded_at: float = None
+        self.thread: threading.Thread = None
+
+    @staticmethod
+    def pre_init(buffer: int = 512):
+        # Must run before pygame.init(), the mixer buffer size can't be changed once opened
+        pygame.mixer.pre_init(frequency=44100, size=-16, channels=2, buffer=buffer)
+
+    def start(self):
+        # Channels 0..n-1 are kept away from Sound.play() so a move sound never waits for a free channel
+        pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), self.channel_count))
+        pygame.mixer.set_reserved(self.channel_count)
+        self.channels = [pygame.mixer.Channel(i) for i in range(self.channel_count)]
+
+        self.thread = threading.Thread(target=self.decode, daemon=True)
+        self.thread.start()
+
+    def decode(self):
+        for key in SoundKey:
+            sound_path = os.path.join(self.folder, key.value)
+            try:
+                self.sounds[key] = pygame.mixer.Sound(sound_path)
+            except (pygame.error, FileNotFoundError) as e:
+                print(f"Failed to load sound {sound_path}: {e}")
+
+        self.loaded_at = time.perf_counter()
+        self.loaded.set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self.loaded.wait(timeout)
+
+    def get(self, key: SoundKey) -> pygame.mixer.Sound | None:
+        return self.sounds.get(key)
+
+    def play(self, key: SoundKey):
+        sound = self.sounds.get(key)
+        if sound is None:
+            return
+
+        if not self.channels:
+            sound.play()
+            return
+
+        channel = self.channels[self.next_channel]
+        self.next_channel = (self.next_channel + 1) % len(self.channels)
+        channel.play(sound)